@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class JRDBConfig(AppConfig):
     name = "jrdb"
+
+    def ready(self):
+        from . import checks  # noqa: F401
@@ -0,0 +1,24 @@
+import inspect
+
+from django.core.checks import Error, register
+from django.core.exceptions import FieldDoesNotExist
+
+
+@register("jrdb")
+def check_templates(app_configs, **kwargs):
+    """
+    Compile the plan of every template so that invalid items are reported by
+    `manage.py check` rather than by the first import that reads such a file
+    """
+    from . import templates
+    from .templates.template import Template
+
+    errors = []
+    for name, template in inspect.getmembers(templates, inspect.isclass):
+        if not issubclass(template, Template):
+            continue
+        try:
+            template.plan()
+        except (AssertionError, LookupError, FieldDoesNotExist) as e:
+            errors.append(Error(str(e), obj=name, id="jrdb.E001"))
+    return errors
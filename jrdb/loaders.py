@@ -1,22 +1,48 @@
+import io
+import time
 from typing import List, Any, Callable, Optional
 
+import numpy as np
 import pandas as pd
 from django.apps import apps
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.db.models import IntegerField
 from django.utils.functional import cached_property
-from sqlalchemy import select, or_, and_
+from sqlalchemy import select, column, table, text
 from sqlalchemy.dialects.postgresql import insert
 
 from .store import store
-from .templates.template import startswith
 
 
 class DjangoPostgresUpsertLoader:
     def __init__(
-        self, df: pd.DataFrame, app_label: str, model_name: str = None
+        self,
+        df: pd.DataFrame,
+        app_label: str,
+        model_name: str = None,
+        batch_rows: int = None,
+        batch_bytes: int = None,
+        target_seconds: float = None,
     ) -> None:
+        """
+        Batch settings default to the JRDB_LOADER_BATCH_* settings, see load(), and
+        0 disables a bound
+        """
         self.df = df
         self.app_label = app_label
         self.model_name = model_name
+        self.batch_rows = (
+            settings.JRDB_LOADER_BATCH_ROWS if batch_rows is None else batch_rows
+        )
+        self.batch_bytes = (
+            settings.JRDB_LOADER_BATCH_BYTES if batch_bytes is None else batch_bytes
+        )
+        self.target_seconds = (
+            settings.JRDB_LOADER_TARGET_SECONDS
+            if target_seconds is None
+            else target_seconds
+        )
 
     @cached_property
     def model(self) -> Any:
@@ -41,23 +67,39 @@ class DjangoPostgresUpsertLoader:
             ]
         return cols
 
+    @cached_property
+    def array_fields(self) -> List[Any]:
+        return [
+            field
+            for field in self.model._meta.concrete_fields
+            if isinstance(field, ArrayField) and field.attname in self.df.columns
+        ]
+
     @cached_property
     def _data(self) -> pd.DataFrame:
         indices = self.df[self.unique_columns].drop_duplicates().index
-        df = self.df.loc[indices]
-
-        # Forcibly upcast values to prevent type errors
-        values = df.to_numpy()
+        return self.df.loc[indices].reset_index(drop=True)
 
-        # Convert all nan values to None. This is work for the transform layer;
-        # but that change requires returning multidimensional arrays of scalar values
-        # as opposed to pandas objects.
-        isna = df.isna().to_numpy()
-        values[isna] = None
+    def _to_python(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Convert a batch of _data to python values with None for missing values
 
-        return pd.DataFrame(values, columns=df.columns)
+        Columns keep their (nullable) dtypes through transform and _data, and only
+        the batch being written is converted. Array items are transformed into
+        rows of a 2d ndarray, which are converted to lists of python scalars.
+        """
+        array_fields = {field.attname: field for field in self.array_fields}
+        return pd.DataFrame(
+            {
+                col: array_to_lists(data[col], array_fields[col].base_field)
+                if col in array_fields
+                else to_python(data[col])
+                for col in data.columns
+            },
+            columns=data.columns,
+        )
 
-    def _build_upsert(self, where: Optional[Callable] = None):
+    def _build_upsert(self, data: pd.DataFrame, where: Optional[Callable] = None):
         """
         To print a representation of this SQL in the console
         specify the postgresql dialect during compilation
@@ -65,9 +107,10 @@ class DjangoPostgresUpsertLoader:
         >>> from sqlalchemy.dialects import postgresql
         >>> print(insert_stmt.compile(dialect=postgresql.dialect()))
         """
-        values = self._data.to_dict("records")
-        insert_stmt = insert(self.table).values(values)
+        values = data.to_dict("records")
+        return self._on_conflict(insert(self.table).values(values), where)
 
+    def _on_conflict(self, insert_stmt, where: Optional[Callable] = None):
         set_ = {
             col: getattr(insert_stmt.excluded, col)
             for col in self._data.columns
@@ -83,40 +126,213 @@ class DjangoPostgresUpsertLoader:
 
         return insert_stmt.on_conflict_do_nothing(index_elements=self.unique_columns)
 
-    def _build_select(self):
-        groups = []
-        for row in self._data.itertuples():
-            conditions = and_(
-                *[
-                    getattr(self.table.c, col) == getattr(row, col)
-                    for col in self.unique_columns
-                ]
-            )
-            groups.append(conditions)
+    def _build_select(self, data: pd.DataFrame):
+        """
+        Select the ids of the rows of data by joining the table against the
+        unnested arrays of their unique keys
+        """
+        dialect = store.engine.dialect
+        quote = dialect.identifier_preparer.quote
 
-        columns = [
-            getattr(self.table.c, column) for column in ["id"] + self.unique_columns
+        keys = [quote(col) for col in self.unique_columns]
+        arrays = [
+            f"CAST(:key_{i} AS {self.table.c[col].type.compile(dialect)}[])"
+            for i, col in enumerate(self.unique_columns)
         ]
-        whereclause = or_(*groups)
+        columns = ", ".join(f"t.{col}" for col in [quote("id")] + keys)
+        on = " AND ".join(f"t.{key} = k.{key}" for key in keys)
 
-        return select(columns).where(whereclause)
+        return text(
+            f"SELECT {columns} FROM {quote(self.table.name)} AS t "
+            f"JOIN unnest({', '.join(arrays)}) AS k({', '.join(keys)}) ON {on}"
+        ).bindparams(
+            **{
+                f"key_{i}": data[col].tolist()
+                for i, col in enumerate(self.unique_columns)
+            }
+        )
+
+    def _stage(self, conn, data: pd.DataFrame) -> None:
+        """
+        Prepare the data the upsert reads within the transaction of a batch
+        """
+
+    @cached_property
+    def row_bytes(self) -> float:
+        """
+        Estimated payload of a row, as the mean size of up to 100 rows in COPY's
+        text format
+        """
+        sample = self._to_python(self._data.iloc[:100])
+        if not len(sample.index):
+            return 1.0
+        return max(len(self._copy_buffer(sample).getvalue()) / len(sample.index), 1.0)
+
+    def _copy_buffer(self, data: pd.DataFrame) -> io.StringIO:
+        buf = io.StringIO()
+        for row in zip(*[data[col].tolist() for col in data.columns]):
+            buf.write("\t".join(map(copy_text, row)))
+            buf.write("\n")
+        buf.seek(0)
+        return buf
+
+    def _batch_rows(self) -> int:
+        """
+        Rows of the first batch, bounded by batch_rows and batch_bytes
+        """
+        rows = len(self._data.index) or 1
+        if self.batch_rows:
+            rows = min(rows, self.batch_rows)
+        if self.batch_bytes:
+            rows = min(rows, int(self.batch_bytes // self.row_bytes))
+        return max(rows, 1)
 
     def load(self, where: Optional[Callable] = None) -> pd.DataFrame:
-        upsert_stmt = self._build_upsert(where)
-        select_stmt = self._build_select()
+        """
+        Upsert the rows of df and return their ids along with their unique keys
 
-        with store.engine.connect() as conn:
-            conn.execute(upsert_stmt)
-            rows = conn.execute(select_stmt)
+        Rows are written in batches of at most batch_rows rows and (an estimated)
+        batch_bytes bytes, each in its own transaction. With target_seconds set, the
+        number of rows of every following batch is scaled (at most halved or
+        doubled) towards that latency, within the same bounds.
 
+        Ids are returned by the upsert itself. Rows it skips, i.e. conflicting rows
+        of DO NOTHING upserts or rows filtered out by `where`, are not returned, in
+        which case the ids of every row of the batch are selected with _build_select.
+        """
         columns = ["id"] + self.unique_columns
-        return pd.DataFrame(rows, columns=columns)
+        max_rows = self._batch_rows()
+        rows = max_rows
+        results = []
+
+        start = 0
+        while start < len(self._data.index):
+            data = self._data.iloc[start : start + rows]
+            started_at = time.monotonic()
+            results.extend(self._load_batch(data, columns, where))
+            elapsed = time.monotonic() - started_at
+            start += len(data.index)
+
+            if self.target_seconds and elapsed > 0:
+                scale = min(max(self.target_seconds / elapsed, 0.5), 2.0)
+                rows = min(max(int(rows * scale), 1), max_rows)
+
+        return pd.DataFrame(results, columns=columns)
+
+    def _load_batch(
+        self, data: pd.DataFrame, columns: List[str], where: Optional[Callable] = None
+    ) -> List[Any]:
+        data = self._to_python(data)
+        upsert_stmt = self._build_upsert(data, where).returning(
+            *[self.table.c[col] for col in columns]
+        )
+
+        with store.engine.begin() as conn:
+            self._stage(conn, data)
+            rows = conn.execute(upsert_stmt).fetchall()
+            if len(rows) < len(data.index):
+                rows = conn.execute(self._build_select(data)).fetchall()
+        return rows
+
+
+class DjangoPostgresCopyLoader(DjangoPostgresUpsertLoader):
+    """
+    Upsert through a temporary staging table filled with COPY FROM STDIN
+
+    Rows are streamed in postgres' text format and inserted with a single
+    INSERT ... SELECT ... ON CONFLICT, rather than binding every value into one
+    VALUES list. The upsert (and the optional where clause) is otherwise the same
+    as that of DjangoPostgresUpsertLoader.
+    """
+
+    @cached_property
+    def staging_table(self):
+        name = f"staging_{self.table.name}"
+        return table(name, *[column(col) for col in self._data.columns])
+
+    def _build_upsert(self, data: pd.DataFrame, where: Optional[Callable] = None):
+        columns = list(data.columns)
+        select_stmt = select([self.staging_table.c[col] for col in columns])
+        insert_stmt = insert(self.table).from_select(columns, select_stmt)
+        return self._on_conflict(insert_stmt, where)
+
+    def _stage(self, conn, data: pd.DataFrame) -> None:
+        quote = conn.dialect.identifier_preparer.quote
+        staging_name = quote(self.staging_table.name)
+        columns = ", ".join(quote(col) for col in data.columns)
+
+        # CREATE TABLE AS copies column types but not constraints, as rows are only
+        # checked when they are upserted into the actual table
+        conn.execute(
+            f"CREATE TEMPORARY TABLE {staging_name} ON COMMIT DROP AS "
+            f"SELECT {columns} FROM {quote(self.table.name)} WITH NO DATA"
+        )
+
+        with conn.connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {staging_name} ({columns}) FROM STDIN", self._copy_buffer(data)
+            )
+
+
+def to_python(se: pd.Series) -> pd.Series:
+    """
+    Convert a Series of any dtype into python objects with None for missing values
+    """
+    return se.astype(object).where(se.notna(), None)
+
+
+def copy_text(value: Any) -> str:
+    """
+    Format a python value (see to_python and array_to_lists) as a column of COPY's
+    text format
+    """
+    if value is None:
+        return "\\N"
+    if isinstance(value, list):
+        text = array_literal(value)
+    elif isinstance(value, (bool, np.bool_)):
+        text = "t" if value else "f"
+    else:
+        text = str(value)
+    return (
+        text.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def array_literal(values: List[Any]) -> str:
+    elements = [
+        "NULL"
+        if value is None
+        else '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+        for value in values
+    ]
+    return "{" + ",".join(elements) + "}"
+
+
+def array_to_lists(se: pd.Series, base_field: Any) -> pd.Series:
+    """
+    Convert a Series of equal length arrays into lists with None for missing values
+    """
+    if not len(se.index):
+        return se
+
+    rows = np.stack(se.to_numpy())
+    isna = pd.isna(rows)
+    values = rows.astype(object)
+    if isinstance(base_field, IntegerField):
+        values[~isna] = rows[~isna].astype(np.int64).astype(object)
+    values[isna] = None
+
+    return pd.Series(values.tolist(), index=se.index, name=se.name)
 
 
 class ProgramRaceLoadMixin:
     def load_programs_races(self):
-        pdf = self.transform.pipe(startswith, "program__", rename=True)
+        pdf = self.group("program")
         programs = self.loader_cls(pdf, "jrdb.Program").load()
-        rdf = self.transform.pipe(startswith, "race__", rename=True)
+        rdf = self.group("race")
         rdf["program_id"] = pdf.merge(programs, how="left").id
         self.loader_cls(rdf, "jrdb.Race").load()
@@ -1,11 +1,10 @@
-import glob
 import logging
 
 from celery import group
 from django.core.management import BaseCommand
 
 from ...tasks import import_file
-from ...templates.template import extract_template_name
+from ...templates.template import extract_template_name, glob_paths
 
 logger = logging.getLogger(__name__)
 
@@ -33,7 +32,10 @@ TEMPLATES = [
 class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument(
-            "path", help="A path (can be glob) pointing to the files to import."
+            "path",
+            help="A path (can be glob) pointing to the files to import. "
+            "Zip archives are read in place, use archive.zip::pattern to select "
+            "members.",
         )
 
     def handle(self, *args, **options):
@@ -42,7 +44,7 @@ class Command(BaseCommand):
 
         logger.info(f"START <{options_repr}>")
 
-        paths = glob.glob(options.get("path"))
+        paths = glob_paths(options.get("path"))
         pending = [p for p in paths if extract_template_name(p) in TEMPLATES]
 
         task_signatures = (import_file.s(path) for path in pending)
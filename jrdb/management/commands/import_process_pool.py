@@ -1,13 +1,21 @@
-import glob
 import logging
+import os
 from concurrent.futures import as_completed
 from concurrent.futures.process import ProcessPoolExecutor
 
 from django.core.management import BaseCommand
+from django.db import connections
 from psycopg2.extensions import TransactionRollbackError
 from sqlalchemy.exc import OperationalError
 
-from ...templates.template import template_factory, extract_template_name
+from ... import templates
+from ...store import store
+from ...templates.template import (
+    template_factory,
+    extract_template_name,
+    get_file_size,
+    glob_paths,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -32,9 +40,15 @@ TEMPLATES = [
 ]
 
 
-def load(path: str) -> str:
-    template = template_factory(path)
-    template.extract().load()
+def load(path: str, chunk_rows: int = None, workers: int = None, **kwargs) -> str:
+    template = template_factory(path, **kwargs)
+    if chunk_rows:
+        template.load_chunks(chunk_rows)
+    elif workers:
+        template.extract_parallel(workers).load()
+    else:
+        template.extract().load()
+    logger.debug(f"pool <{store.pool_status()}>")
     return template.path
 
 
@@ -49,7 +63,10 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument(
-            "path", help="A path (can be glob) pointing to the files to import."
+            "path",
+            help="A path (can be glob) pointing to the files to import. "
+            "Zip archives are read in place, use archive.zip::pattern to select "
+            "members.",
         )
         parser.add_argument(
             "-m",
@@ -57,6 +74,32 @@ class Command(BaseCommand):
             type=int,
             help="Max number of processes in pool (defaults to number of processors on the machine)",
         )
+        parser.add_argument(
+            "--memory-map",
+            action="store_true",
+            help="Map files into memory instead of reading them onto the heap",
+        )
+        parser.add_argument(
+            "--chunk-rows",
+            type=int,
+            help="Extract, transform and load files in chunks of this many rows",
+        )
+        parser.add_argument(
+            "--split-size",
+            type=float,
+            help="Import files larger than this many megabytes first, one at a time, "
+            "splitting each file across all workers",
+        )
+        parser.add_argument(
+            "--transform-workers",
+            type=int,
+            help="Transform the columns of each file with this many threads",
+        )
+        parser.add_argument(
+            "--cache-dir",
+            help="Cache transformed files in this directory and skip parsing files "
+            "whose content is unchanged",
+        )
 
     def handle(self, *args, **options):
         options_repr = ", ".join(
@@ -69,16 +112,65 @@ class Command(BaseCommand):
 
         pending = [
             path
-            for path in glob.glob(options.get("path"))
+            for path in glob_paths(options.get("path"))
             if extract_template_name(path) in TEMPLATES
         ]
         pending_len = len(pending)
 
+        # compile plans and load foreign key lookups before the pool forks so that
+        # workers inherit them, but not this process's connection
+        for name in TEMPLATES:
+            getattr(templates, name).preload()
+        connections.close_all()
+
+        if options.get("split_size"):
+            split_size = options.get("split_size") * 2 ** 20
+            workers = options.get("max_workers") or os.cpu_count()
+            for path in [p for p in pending if get_file_size(p) >= split_size]:
+                # deadlocked files are retried like in the pool below, and left
+                # pending for it once attempts_max is reached
+                for attempt in range(1, attempts_max + 1):
+                    logger.info(
+                        f"import <path {path}, workers {workers}, attempt {attempt}>"
+                    )
+                    try:
+                        load(
+                            path,
+                            workers=workers,
+                            memory_map=options.get("memory_map"),
+                            cache_dir=options.get("cache_dir"),
+                            transform_workers=options.get("transform_workers"),
+                        )
+                    except (OperationalError, TransactionRollbackError) as e:
+                        self._log_deadlock(e, path)
+                        continue
+                    except Exception as e:
+                        logger.exception(e)
+                        self._increment_error_count()
+                    else:
+                        self._increment_success_count()
+                    pending.remove(path)
+                    break
+
+            # do not share this process's connections with the pool
+            connections.close_all()
+            store.dispose()
+
         with ProcessPoolExecutor(options.get("max_workers")) as executor:
             while len(pending) > 0 and attempts < attempts_max:
                 attempts += 1
 
-                futures = {executor.submit(load, path): path for path in pending}
+                futures = {
+                    executor.submit(
+                        load,
+                        path,
+                        chunk_rows=options.get("chunk_rows"),
+                        memory_map=options.get("memory_map"),
+                        cache_dir=options.get("cache_dir"),
+                        transform_workers=options.get("transform_workers"),
+                    ): path
+                    for path in pending
+                }
 
                 for future in as_completed(futures):
                     remaining = len(pending)
@@ -94,9 +186,7 @@ class Command(BaseCommand):
                     try:
                         future.result()
                     except (OperationalError, TransactionRollbackError) as e:
-                        message = e.args[0].split("\n")[0]
-                        logger.info(f"{message} <{path}>")
-                        self._increment_deadlock_count()
+                        self._log_deadlock(e, path)
                     except Exception as e:
                         logger.exception(e)
                         pending.remove(path)
@@ -115,6 +205,11 @@ class Command(BaseCommand):
             f">"
         )
 
+    def _log_deadlock(self, e: Exception, path: str):
+        message = e.args[0].split("\n")[0]
+        logger.info(f"{message} <{path}>")
+        self._increment_deadlock_count()
+
     def _increment_error_count(self):
         self.error_count += 1
 
@@ -8,4 +8,15 @@ class DataFrameQuerySet(models.QuerySet):
         records = (
             self.values() if issubclass(self._iterable_class, ModelIterable) else self
         )
-        return pd.DataFrame.from_records(records)
+        df = pd.DataFrame.from_records(records)
+
+        # choice fields are categorical, as they are in transformed templates
+        return df.astype(
+            {
+                field.attname: pd.CategoricalDtype(
+                    sorted(value for value, _ in field.flatchoices)
+                )
+                for field in self.model._meta.concrete_fields
+                if field.choices and field.attname in df.columns
+            }
+        )
@@ -1,12 +1,62 @@
+import os
+from typing import Any, Dict, List, Optional
+
+from django.apps import apps
+from django.conf import settings
 from django.db import connection
 from django.utils.functional import cached_property
-from sqlalchemy import create_engine, MetaData, Table
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    Date,
+    DateTime,
+    Float,
+    Integer,
+    MetaData,
+    SmallInteger,
+    String,
+    Table,
+    Text,
+    create_engine,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.engine.url import URL
 
+FIELD_TYPE_MAP: Dict[str, Any] = {
+    "AutoField": Integer,
+    "BigAutoField": BigInteger,
+    "SmallIntegerField": SmallInteger,
+    "PositiveSmallIntegerField": SmallInteger,
+    "IntegerField": Integer,
+    "PositiveIntegerField": Integer,
+    "BigIntegerField": BigInteger,
+    "FloatField": Float,
+    "TextField": Text,
+    "DateField": Date,
+    "BooleanField": Boolean,
+    "NullBooleanField": Boolean,
+}
+
 
 class SQLAlchemyModelStore:
+    """
+    SQLAlchemy tables by name
+
+    Tables of Django models are built from the model's _meta and cached for the
+    process, so that loaders do not reflect the database. Other tables, and tables
+    of models with field types missing from FIELD_TYPE_MAP, are reflected once.
+
+    The engine of `store` is created per process: a forked child (process pool or
+    celery prefork worker) creates its own engine on first use and reuses its
+    pooled connections for every file it loads. Pool settings are read from the
+    JRDB_DB_POOL_* settings.
+    """
+
     def __init__(self):
         self._tables = {}
+        # engines inherited from the parent process, see _after_fork_in_child
+        self._inherited: List[Any] = []
 
     @cached_property
     def engine(self):
@@ -19,16 +69,88 @@ class SQLAlchemyModelStore:
             cnf["PORT"],
             cnf["NAME"],
         )
-        return create_engine(url)
+        return create_engine(
+            url,
+            pool_size=settings.JRDB_DB_POOL_SIZE,
+            max_overflow=settings.JRDB_DB_MAX_OVERFLOW,
+            pool_pre_ping=settings.JRDB_DB_POOL_PRE_PING,
+        )
+
+    def dispose(self) -> None:
+        """
+        Close the pooled connections of this process, e.g. before forking workers
+        """
+        if "engine" in self.__dict__:
+            self.engine.dispose()
+
+    def pool_status(self) -> Dict[str, int]:
+        """
+        Connections of this process's pool, to size it against max_connections
+        """
+        pool = self.engine.pool
+        return {
+            "pid": os.getpid(),
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+        }
+
+    def _after_fork_in_child(self) -> None:
+        # The parent's connections must not be used, nor closed (which would end the
+        # parent's sessions), so its engine is kept referenced but never used again
+        if "engine" in self.__dict__:
+            self._inherited.append(self.__dict__.pop("engine"))
 
     @cached_property
     def meta(self):
-        return MetaData(bind=self.engine)
+        return MetaData()
+
+    @cached_property
+    def models(self) -> Dict[str, Any]:
+        return {model._meta.db_table: model for model in apps.get_models()}
 
     def __getitem__(self, item):
-        if item in self._tables:
-            return self._tables[item]
-        return Table(item, self.meta, autoload=True)
+        if item not in self._tables:
+            model = self.models.get(item)
+            table = model_table(model, self.meta) if model else None
+            if table is None:
+                table = Table(item, self.meta, autoload=True, autoload_with=self.engine)
+            self._tables[item] = table
+        return self._tables[item]
+
+
+def model_table(model: Any, meta: MetaData) -> Optional[Table]:
+    """
+    The table of model, or None when one of its field types is not mapped
+    """
+    columns = []
+    for field in model._meta.concrete_fields:
+        type_ = column_type(field)
+        if type_ is None:
+            return None
+        columns.append(Column(field.column, type_, primary_key=field.primary_key))
+    return Table(model._meta.db_table, meta, *columns)
+
+
+def column_type(field: Any) -> Optional[Any]:
+    """
+    The SQLAlchemy type of a model field, or None when its type is not mapped
+    """
+    internal_type = field.get_internal_type()
+    if internal_type == "ForeignKey":
+        return column_type(field.target_field)
+    if internal_type == "ArrayField":
+        base_type = column_type(field.base_field)
+        return ARRAY(base_type) if base_type is not None else None
+    if internal_type == "CharField":
+        return String(field.max_length)
+    if internal_type == "DateTimeField":
+        return DateTime(timezone=True)
+    type_ = FIELD_TYPE_MAP.get(internal_type)
+    return type_() if type_ else None
 
 
 store = SQLAlchemyModelStore()
+# registered once for the process-wide store, as hooks cannot be unregistered
+os.register_at_fork(after_in_child=store._after_fork_in_child)
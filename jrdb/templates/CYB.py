@@ -1,5 +1,5 @@
 from ..models import choices
-from .template import Template, startswith
+from .template import Template
 from .item import (
     IntegerItem,
     StringItem,
@@ -119,14 +119,14 @@ class CYB(Template):
     ]
 
     def load(self):
-        pdf = self.transform.pipe(startswith, "program__", rename=True)
+        pdf = self.group("program")
         programs = self.loader_cls(pdf, "jrdb.Program").load()
 
-        rdf = self.transform.pipe(startswith, "race__", rename=True)
+        rdf = self.group("race")
         rdf["program_id"] = pdf.merge(programs, how="left").id
         races = self.loader_cls(rdf, "jrdb.Race").load()
 
-        cdf = self.transform.pipe(startswith, "contender__", rename=True)
+        cdf = self.group("contender")
         cdf["race_id"] = rdf[["program_id", "num"]].merge(races, how="left").id
 
         self.loader_cls(cdf, "jrdb.Contender").load()
@@ -3,7 +3,7 @@ from django.utils.functional import cached_property
 
 from ..models import choices
 from .item import ChoiceItem, DateItem, ArrayItem, StringItem, IntegerItem
-from .template import Template, startswith
+from .template import Template
 
 
 def where(stmt):
@@ -18,6 +18,7 @@ class CZA(Template):
     """
 
     description = "全調教師"
+    transform_requires = ["trainer__name"]
     items = [
         StringItem("調教師コード", 5, 0, "jrdb.Trainer.code"),
         # 'is_retired', '登録抹消フラグ', width=1, start=5
@@ -52,5 +53,5 @@ class CZA(Template):
         return super().transform
 
     def load(self):
-        df = self.transform.pipe(startswith, "trainer__", rename=True)
+        df = self.group("trainer")
         self.loader_cls(df, "jrdb.Trainer").load(where=where)
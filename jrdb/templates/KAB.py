@@ -1,7 +1,7 @@
 import numpy as np
 
 from ..models import choices
-from .template import Template, startswith
+from .template import Template
 from .item import (
     ForeignKeyItem,
     IntegerItem,
@@ -108,5 +108,5 @@ class KAB(Template):
     ]
 
     def load(self):
-        df = self.transform.pipe(startswith, "program__", rename=True)
+        df = self.group("program")
         self.loader_cls(df, "jrdb.Program").load()
@@ -8,7 +8,7 @@ from .item import (
     BooleanItem,
     DateItem,
 )
-from .template import Template, startswith
+from .template import Template
 
 
 class KYI(Template):
@@ -18,6 +18,7 @@ class KYI(Template):
     """
 
     description = "JRDB競走馬データ（KYI）"
+    dedupe_transform = True
     items = [
         # レースキー
         ForeignKeyItem("場コード", 2, 0, "jrdb.Program.racetrack", "jrdb.Racetrack.code"),
@@ -399,23 +400,23 @@ class KYI(Template):
     ]
 
     def load(self):
-        pdf = self.transform.pipe(startswith, "program__", rename=True)
+        pdf = self.group("program")
         programs = self.loader_cls(pdf, "jrdb.Program").load()
 
-        hdf = self.transform.pipe(startswith, "horse__", rename=True)
+        hdf = self.group("horse")
         horses = self.loader_cls(hdf, "jrdb.Horse").load()
 
-        jdf = self.transform.pipe(startswith, "jockey__", rename=True)
+        jdf = self.group("jockey")
         jockeys = self.loader_cls(jdf, "jrdb.Jockey").load()
 
-        tdf = self.transform.pipe(startswith, "trainer__", rename=True)
+        tdf = self.group("trainer")
         trainers = self.loader_cls(tdf, "jrdb.Trainer").load()
 
-        rdf = self.transform.pipe(startswith, "race__", rename=True)
+        rdf = self.group("race")
         rdf["program_id"] = pdf.merge(programs, how="left").id
         races = self.loader_cls(rdf, "jrdb.Race").load()
 
-        cdf = self.transform.pipe(startswith, "contender__", rename=True)
+        cdf = self.group("contender")
         cdf["race_id"] = rdf[["program_id", "num"]].merge(races, how="left").id
         cdf["horse_id"] = hdf.merge(horses, how="left").id
         cdf["jockey_id"] = jdf.merge(jockeys, how="left").id
@@ -1,7 +1,7 @@
 from django.utils.functional import cached_property
 
 from ..models import choices
-from .template import Template, startswith
+from .template import Template
 from .item import StringItem, DateItem, ChoiceItem, IntegerItem, ArrayItem
 
 
@@ -17,6 +17,7 @@ class KZA(Template):
     """
 
     description = "全騎手"
+    transform_requires = ["jockey__name"]
     items = [
         StringItem("騎手コード", 5, 0, "jrdb.Jockey.code"),
         # 'is_retired', '登録抹消フラグ', width=1, start=5
@@ -53,5 +54,5 @@ class KZA(Template):
         return super().transform
 
     def load(self):
-        df = self.transform.pipe(startswith, "jockey__", rename=True)
+        df = self.group("jockey")
         self.loader_cls(df, "jrdb.Jockey").load(where=where)
@@ -1,3 +1,5 @@
+import numpy as np
+
 from .item import ArrayItem, IntegerItem, StringItem, ForeignKeyItem
 from ..loaders import ProgramRaceLoadMixin
 from .template import Template
@@ -9,6 +11,8 @@ class OV(Template, ProgramRaceLoadMixin):
     """
 
     description = "３連単基準オッズデータ（OV）"
+    # every race carries 4896 trifecta odds
+    loader_options = {"batch_bytes": 4 * 2 ** 20}
     items = [
         ForeignKeyItem("場コード", 2, 0, "jrdb.Program.racetrack", "jrdb.Racetrack.code"),
         IntegerItem("年", 2, 2, "jrdb.Program.yr"),
@@ -22,7 +26,7 @@ class OV(Template, ProgramRaceLoadMixin):
             10,
             "jrdb.Race.odds_trifecta",
             4896,
-            lambda n: None if n is None else round(n * 0.1, 1),
+            lambda a: np.round(a * 0.1, 1),
         ),
     ]
 
@@ -1,9 +1,8 @@
 import numpy as np
 import pandas as pd
-from django.utils.functional import cached_property
 
 from ..models import choices
-from .template import Template, startswith
+from .template import Template, group_mode
 from .item import (
     StringItem,
     ForeignKeyItem,
@@ -79,6 +78,26 @@ class SED(Template):
     """
 
     description = "JRDB成績データ（SED）"
+    # race level modes are computed from every contender in the race
+    chunk_by = [
+        "program__racetrack_code",
+        "program__yr",
+        "program__round",
+        "program__day",
+        "race__num",
+    ]
+    dedupe_transform = True
+    race_by = [
+        "program__racetrack_id",
+        "program__yr",
+        "program__round",
+        "program__day",
+        "race__num",
+    ]
+    race_aggregates = {
+        "race__track_speed_shift": group_mode,
+        "race__pace_cat": group_mode,
+    }
 
     items = [
         # レースキー
@@ -229,43 +248,24 @@ class SED(Template):
         ),
     ]
 
-    @cached_property
-    def transform(self) -> pd.DataFrame:
-        df = super(SED, self).transform
-
-        for key, group in df.groupby(["program__racetrack_id", "race__num"]):
-            ss = "race__track_speed_shift"
-            pc = "race__pace_cat"
-
-            mode_ss = group[ss].mode()
-            mode_pc = group[pc].mode()
-
-            if len(mode_ss.index):
-                df.loc[group.index, ss] = mode_ss.iloc[0]
-
-            if len(mode_pc.index):
-                df.loc[group.index, pc] = mode_pc.iloc[0]
-
-        return df
-
     def load(self):
-        pdf = self.transform.pipe(startswith, "program__", rename=True)
+        pdf = self.group("program")
         programs = self.loader_cls(pdf, "jrdb.Program").load()
 
-        hdf = self.transform.pipe(startswith, "horse__", rename=True)
+        hdf = self.group("horse")
         horses = self.loader_cls(hdf, "jrdb.Horse").load()
 
-        jdf = self.transform.pipe(startswith, "jockey__", rename=True)
+        jdf = self.group("jockey")
         jockeys = self.loader_cls(jdf, "jrdb.Jockey").load()
 
-        tdf = self.transform.pipe(startswith, "trainer__", rename=True)
+        tdf = self.group("trainer")
         trainers = self.loader_cls(tdf, "jrdb.Trainer").load()
 
-        rdf = self.transform.pipe(startswith, "race__", rename=True)
+        rdf = self.group("race")
         rdf["program_id"] = pdf.merge(programs, how="left").id
         races = self.loader_cls(rdf, "jrdb.Race").load()
 
-        cdf = self.transform.pipe(startswith, "contender__", rename=True)
+        cdf = self.group("contender")
         cdf["race_id"] = rdf[["program_id", "num"]].merge(races, how="left").id
         cdf["horse_id"] = hdf.merge(horses, how="left").id
         cdf["jockey_id"] = jdf.merge(jockeys, how="left").id
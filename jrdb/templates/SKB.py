@@ -1,4 +1,4 @@
-from .template import Template, startswith
+from .template import Template
 from .item import ForeignKeyItem, IntegerItem, StringItem, BooleanItem, ArrayItem
 
 
@@ -47,17 +47,17 @@ class SKB(Template):
     ]
 
     def load(self):
-        pdf = self.transform.pipe(startswith, "program__", rename=True)
+        pdf = self.group("program")
         programs = self.loader_cls(pdf, "jrdb.Program").load()
 
-        hdf = self.transform.pipe(startswith, "horse__", rename=True)
+        hdf = self.group("horse")
         horses = self.loader_cls(hdf, "jrdb.Horse").load()
 
-        rdf = self.transform.pipe(startswith, "race__", rename=True)
+        rdf = self.group("race")
         rdf["program_id"] = pdf.merge(programs, how="left").id
         races = self.loader_cls(rdf, "jrdb.Race").load()
 
-        cdf = self.transform.pipe(startswith, "contender__", rename=True)
+        cdf = self.group("contender")
         cdf["race_id"] = rdf[["program_id", "num"]].merge(races, how="left").id
         cdf["horse_id"] = hdf.merge(horses, how="left").id
         self.loader_cls(cdf, "jrdb.Contender").load()
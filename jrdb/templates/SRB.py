@@ -1,3 +1,5 @@
+import numpy as np
+
 from .item import ForeignKeyItem, IntegerItem, StringItem, ArrayItem
 from ..loaders import ProgramRaceLoadMixin
 from .template import Template
@@ -21,7 +23,7 @@ class SRB(Template, ProgramRaceLoadMixin):
             8,
             "jrdb.Race.furlong_times",
             size=18,
-            mapper=lambda n: None if n is None else round(n * 0.1, 1),
+            mapper=lambda a: np.round(a * 0.1, 1),
         ),
         # ArrayItem('１コーナー', 64, 62, 'jrdb.Race.c1pos', ),  # TODO: 意味不明
         # ArrayItem('２コーナー', 64, 126, 'jrdb.Race.c2pos', ),  # TODO: 意味不明
@@ -7,7 +7,7 @@ from .item import (
     ForeignKeyItem,
     BooleanItem,
 )
-from .template import Template, startswith
+from .template import Template
 
 
 def where(stmt):
@@ -56,5 +56,5 @@ class UKC(Template):
     ]
 
     def load(self):
-        df = self.transform.pipe(startswith, "horse__", rename=True)
+        df = self.group("horse")
         self.loader_cls(df, "jrdb.Horse").load(where=where)
@@ -0,0 +1,54 @@
+import hashlib
+import os
+import tempfile
+from typing import Any, Optional
+
+import pandas as pd
+from django.utils.functional import cached_property
+
+# number of records hashed at a time, to bound the memory used by tobytes()
+HASH_BLOCK_ROWS = 4096
+
+
+class TransformCache:
+    """
+    On-disk cache of the transform output of a template
+
+    Entries are keyed by the content of the template's records, the template class
+    and its transform_version, so an edited file, a change to the items (mapper and
+    handler code included), to the class settings or transform overrides of the
+    template or a bump of PLAN_VERSION all miss. Foreign keys are cached as database ids, which assumes
+    code tables keep the primary keys of their fixtures.
+    """
+
+    def __init__(self, cache_dir: str, template: Any) -> None:
+        self.cache_dir = cache_dir
+        self.template = template
+
+    @cached_property
+    def path(self) -> str:
+        records = self.template.records
+        digest = hashlib.sha256()
+        digest.update(self.template.transform_version().encode())
+        digest.update(repr(records.shape).encode())
+        for start in range(0, len(records), HASH_BLOCK_ROWS):
+            digest.update(records[start : start + HASH_BLOCK_ROWS].tobytes())
+
+        cls = self.template.__class__
+        dirname = f"{cls.__module__}.{cls.__qualname__}"
+        return os.path.join(self.cache_dir, dirname, f"{digest.hexdigest()}.pkl")
+
+    def get(self) -> Optional[pd.DataFrame]:
+        if os.path.exists(self.path):
+            return pd.read_pickle(self.path)
+        return None
+
+    def set(self, df: pd.DataFrame) -> None:
+        dirname = os.path.dirname(self.path)
+        os.makedirs(dirname, exist_ok=True)
+
+        # write then rename so that concurrent workers never read a partial file
+        fd, tmp = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+        os.close(fd)
+        df.to_pickle(tmp)
+        os.replace(tmp, self.path)
@@ -1,10 +1,12 @@
 from abc import ABC
 from dataclasses import dataclass
-from typing import Optional, Union, Any, Callable, Tuple, Dict
+from functools import lru_cache
+from typing import Optional, Union, Any, Callable, Tuple, Dict, Iterable, List, Set
 
 import numpy as np
 import pandas as pd
 from django.apps import apps
+from django.utils.functional import cached_property
 
 MODEL_ITEM_FIELD_MAP: Dict[str, Tuple[str]] = {
     "IntegerItem": (
@@ -22,6 +24,11 @@ MODEL_ITEM_FIELD_MAP: Dict[str, Tuple[str]] = {
     "BooleanItem": ("BooleanField", "NullBooleanField"),
 }
 
+# related symbol -> {value of the related field: id}, shared by the whole process
+RELATED_IDS: Dict[str, Dict[Any, int]] = {}
+# related symbol -> values looked up and not found, until clear_related_ids
+RELATED_MISSES: Dict[str, Set[Any]] = {}
+
 
 def parse_int_or(value: str, default: Optional[Any] = None) -> Optional[int]:
     try:
@@ -37,6 +44,103 @@ def parse_float_or(value: str, default: Optional[Any] = None) -> Optional[float]
         return default
 
 
+def parse_int_array(cells: np.ndarray) -> np.ndarray:
+    """
+    parse_int_or over every cell of an array of bytes or str cells
+
+    Returns float64 with NaN for cells that are not integers, as an integer dtype
+    cannot represent missing values
+    """
+    return _parse_array(cells, np.int64, parse_int_or)
+
+
+def parse_float_array(cells: np.ndarray) -> np.ndarray:
+    """
+    parse_float_or over every cell of an array of bytes or str cells, with NaN for
+    cells that are not numbers
+    """
+    return _parse_array(cells, np.float64, parse_float_or)
+
+
+def _parse_array(cells: np.ndarray, dtype: Any, parse: Callable) -> np.ndarray:
+    cells = np.char.strip(cells)
+    values = np.full(cells.shape, np.nan)
+    mask = cells != cells.dtype.type()
+    try:
+        values[mask] = cells[mask].astype(dtype)
+    except (ValueError, OverflowError):
+        # fall back to parsing cell by cell when numpy cannot parse every value
+        values[mask] = [parse(cell, np.nan) for cell in cells[mask]]
+    return values
+
+
+def decode_ascii(cells: np.ndarray) -> np.ndarray:
+    """
+    Decode fixed width bytes cells of numbers or dates, which are pure ASCII
+    """
+    return np.char.decode(cells, "ascii", errors="replace")
+
+
+@lru_cache(maxsize=None)
+def get_model(label: str) -> Any:
+    """
+    apps.get_model, cached as the app registry does not change once it is ready
+    """
+    return apps.get_model(label)
+
+
+@lru_cache(maxsize=None)
+def get_field(symbol: str) -> Any:
+    """
+    The model field named by symbol (app_label.Model.field), cached like get_model
+    """
+    model, field = symbol.rsplit(".", maxsplit=1)
+    return get_model(model)._meta.get_field(field)
+
+
+def get_related_ids(symbol: str, values: Iterable = None) -> Dict[Any, int]:
+    """
+    Ids of the rows of the model of symbol keyed by the value of its field
+
+    The whole table is loaded on first use and cached for the process, as foreign
+    keys point to small code tables loaded from fixtures. Passed values missing from
+    the cache are looked up once so that rows created since are picked up, and are
+    remembered as missing when not found (e.g. blank codes); call clear_related_ids
+    after rows are created, updated or deleted.
+    """
+    field = get_field(symbol)
+    ids = RELATED_IDS.get(symbol)
+    if ids is None:
+        ids = RELATED_IDS[symbol] = dict(
+            field.model.objects.values_list(field.name, "id")
+        )
+    elif values is not None:
+        misses = RELATED_MISSES.setdefault(symbol, set())
+        missing = [
+            value for value in values if value not in ids and value not in misses
+        ]
+        if missing:
+            ids.update(
+                field.model.objects.filter(
+                    **{f"{field.name}__in": missing}
+                ).values_list(field.name, "id")
+            )
+            misses.update(value for value in missing if value not in ids)
+    return ids
+
+
+def clear_related_ids(symbol: str = None) -> None:
+    """
+    Invalidate the get_related_ids cache of symbol, or of every symbol
+    """
+    if symbol is None:
+        RELATED_IDS.clear()
+        RELATED_MISSES.clear()
+    else:
+        RELATED_IDS.pop(symbol, None)
+        RELATED_MISSES.pop(symbol, None)
+
+
 def lower_first(value: str) -> str:
     assert isinstance(value, str)
     return value[:1].lower() + value[1:] if value else ""
@@ -52,10 +156,23 @@ class Item(ABC):
     def key(self) -> str:
         return self.label
 
-    def transform(self, s: pd.Series) -> Union[pd.Series, pd.DataFrame]:
+    @property
+    def encoding(self) -> Optional[str]:
+        """
+        Encoding of the extracted cells, or None to hand them to transform as an
+        ndarray of fixed width bytes
+        """
+        return "cp932"
+
+    def transform(self, s: Any) -> Union[pd.Series, pd.DataFrame]:
+        """
+        Transform the extracted cells: a Series of str, or an ndarray for items
+        without encoding and for array items (see Column.ndarray), in which case
+        the result is indexed by position
+        """
         raise NotImplementedError
 
-    def _validate(self) -> None:
+    def validate(self) -> None:
         assert self.width >= 0, "width must be greater than or equal to 0"
         assert self.start >= 0, "start must be greater than or equal to 0"
 
@@ -64,21 +181,20 @@ class Item(ABC):
 class ModelItem(Item, ABC):
     symbol: str
 
-    @property
+    @cached_property
     def key(self) -> str:
         value = self.symbol.split(".", maxsplit=1).pop()
         return lower_first(value).replace(".", "__")
 
     def get_model(self) -> Any:
         model, _ = self.symbol.rsplit(".", maxsplit=1)
-        return apps.get_model(model)
+        return get_model(model)
 
     def get_field(self) -> Any:
-        _, field = self.symbol.rsplit(".", maxsplit=1)
-        return self.get_model()._meta.get_field(field)
+        return get_field(self.symbol)
 
-    def _validate(self) -> None:
-        super()._validate()
+    def validate(self) -> None:
+        super().validate()
         assert len(self.symbol.split(".")) == 3, f"invalid symbol <{self.symbol}>"
 
         internal_type = self.get_field().get_internal_type()
@@ -92,9 +208,15 @@ class ModelItem(Item, ABC):
 class IntegerItem(ModelItem):
     default: Optional[int] = None
 
-    def transform(self, s: pd.Series) -> Union[pd.Series, pd.DataFrame]:
-        self._validate()
-        return s.apply(parse_int_or, args=(self.default,)).astype("Int64")
+    @property
+    def encoding(self) -> Optional[str]:
+        return None
+
+    def transform(self, cells: np.ndarray) -> Union[pd.Series, pd.DataFrame]:
+        values = parse_int_array(cells)
+        if self.default is not None:
+            values[np.isnan(values)] = self.default
+        return pd.Series(values, name=self.key).astype("Int64")
 
 
 @dataclass(eq=False, frozen=True)
@@ -102,13 +224,15 @@ class FloatItem(ModelItem):
     default: Optional[float] = np.nan
     scale: float = 1.0
 
-    def transform(self, s: pd.Series) -> Union[pd.Series, pd.DataFrame]:
-        self._validate()
-        return (
-            s.apply(parse_float_or, args=(self.default,))
-            .apply(lambda n: n * self.scale)
-            .astype(float)
-        )
+    @property
+    def encoding(self) -> Optional[str]:
+        return None
+
+    def transform(self, cells: np.ndarray) -> Union[pd.Series, pd.DataFrame]:
+        values = parse_float_array(cells)
+        if self.default is not None:
+            values[np.isnan(values)] = self.default
+        return pd.Series(values * self.scale, name=self.key)
 
 
 @dataclass(eq=False, frozen=True)
@@ -124,28 +248,43 @@ class ArrayItem(ModelItem):
     def base_field(self):
         return self.get_field().base_field
 
-    def transform(self, se: pd.Series) -> Union[pd.Series, pd.DataFrame]:
-        self._validate()
+    @property
+    def encoding(self) -> Optional[str]:
+        base_field_type = self.base_field.get_internal_type()
+        if (
+            base_field_type in MODEL_ITEM_FIELD_MAP["IntegerItem"]
+            or base_field_type in MODEL_ITEM_FIELD_MAP["FloatItem"]
+        ):
+            return None
+        return super().encoding
+
+    def transform(self, cells: np.ndarray) -> Union[pd.Series, pd.DataFrame]:
+        """
+        Parse the (rows, size) array of cells into one contiguous array
+
+        Numeric arrays are float64 with NaN for blank cells and other arrays are
+        object arrays with None for blank cells. The mapper, if any, is called with
+        the whole array. Rows are returned as views into the array and are only
+        converted to lists when loaded into the database.
+        """
 
         base_field_type = self.base_field.get_internal_type()
 
-        se = se.copy()
         if base_field_type in MODEL_ITEM_FIELD_MAP["IntegerItem"]:
-            se = se.apply(lambda a: [parse_int_or(el) for el in a])
+            values = parse_int_array(cells)
         elif base_field_type in MODEL_ITEM_FIELD_MAP["FloatItem"]:
-            se = se.apply(lambda a: [parse_float_or(el) for el in a])
+            values = parse_float_array(cells)
         else:
-            se = se.map(list).map(
-                lambda lst: [None if x.replace(" ", "") == "" else x for x in lst]
-            )
+            values = cells.astype(object)
+            values[np.char.replace(cells, " ", "") == ""] = None
 
         if self.mapper:
-            se = se.apply(lambda arr: [self.mapper(item) for item in arr])
+            values = self.mapper(values)
 
-        return se
+        return pd.Series(list(values), name=self.key, dtype=object)
 
-    def _validate(self) -> None:
-        super()._validate()
+    def validate(self) -> None:
+        super().validate()
         assert (
             self.size >= 0
         ), f"size must be greater than or equal to zero <size: {self.size}>"
@@ -158,37 +297,30 @@ class ArrayItem(ModelItem):
 class ForeignKeyItem(ModelItem):
     related_symbol: str
 
-    @property
+    @cached_property
     def key(self) -> str:
-        key = super(ForeignKeyItem, self).key
-        return "_".join([key, self.get_remote_field().name])
+        # the name of the remote field, without resolving it so that keys are known
+        # before the app registry is ready
+        _, remote_field_name = self.related_symbol.rsplit(".", maxsplit=1)
+        return "_".join([super().key, remote_field_name])
 
     def get_remote_field(self):
-        model, field = self.related_symbol.rsplit(".", maxsplit=1)
-        return apps.get_model(model)._meta.get_field(field)
+        return get_field(self.related_symbol)
 
-    def transform(self, s: pd.Series) -> Union[pd.Series, pd.DataFrame]:
-        self._validate()
-        remote_field = self.get_remote_field()
+    def preload(self) -> None:
+        get_related_ids(self.related_symbol)
 
-        remote_records = remote_field.model.objects.filter(
-            **{f"{remote_field.name}__in": s}
-        ).values(remote_field.name, "id")
+    def transform(self, s: pd.Series) -> Union[pd.Series, pd.DataFrame]:
+        ids = get_related_ids(self.related_symbol, s.dropna().unique())
 
         model_name = self.get_model()._meta.model_name
         field_name = self.get_field().column
         index_name = "__".join((model_name, field_name))
 
-        return (
-            s.map(
-                {record[remote_field.name]: record["id"] for record in remote_records}
-            )
-            .astype("Int64")
-            .rename(index_name)
-        )
+        return s.map(ids).astype("Int64").rename(index_name)
 
-    def _validate(self) -> None:
-        super()._validate()
+    def validate(self) -> None:
+        super().validate()
         symbol_parts = len(self.related_symbol.split("."))
         assert symbol_parts == 3, f"invalid related symbol <{self.related_symbol}>"
 
@@ -197,8 +329,12 @@ class ForeignKeyItem(ModelItem):
 class DateItem(ModelItem):
     format: str = "%Y%m%d"
 
-    def transform(self, s: pd.Series) -> Union[pd.Series, pd.DataFrame]:
-        self._validate()
+    @property
+    def encoding(self) -> Optional[str]:
+        return None
+
+    def transform(self, cells: np.ndarray) -> Union[pd.Series, pd.DataFrame]:
+        s = pd.Series(decode_ascii(cells), name=self.key)
         date = pd.to_datetime(s, format=self.format, errors="coerce").dt.date
         return date.astype(object).where(date.notnull(), None)
 
@@ -208,19 +344,18 @@ class DateTimeItem(ModelItem):
     format: str = "%Y%m%d%H%M"
     tz: str = "Asia/Tokyo"
 
-    def transform(self, s: pd.Series) -> Union[pd.Series, pd.DataFrame]:
-        self._validate()
-        return (
-            pd.to_datetime(s, format=self.format)
-            .dt.tz_localize(self.tz)
-            .rename(self.key)
-        )
+    @property
+    def encoding(self) -> Optional[str]:
+        return None
+
+    def transform(self, cells: np.ndarray) -> Union[pd.Series, pd.DataFrame]:
+        s = pd.Series(decode_ascii(cells), name=self.key)
+        return pd.to_datetime(s, format=self.format).dt.tz_localize(self.tz)
 
 
 @dataclass(eq=False, frozen=True)
 class StringItem(ModelItem):
     def transform(self, se: pd.Series) -> Union[pd.Series, pd.DataFrame]:
-        self._validate()
         return (
             se.str.strip()
             .str.replace("\u3000", " ")
@@ -232,9 +367,14 @@ class StringItem(ModelItem):
 class ChoiceItem(ModelItem):
     options: dict
 
+    @property
+    def categories(self) -> List[str]:
+        # sorted, so that ordering (e.g. mode) matches that of the plain values
+        return sorted(set(self.options.values()))
+
     def transform(self, s: pd.Series) -> Union[pd.Series, pd.DataFrame]:
-        self._validate()
-        return s.str.strip().map(self.options)
+        values = s.str.strip().map(self.options)
+        return values.astype(pd.CategoricalDtype(self.categories))
 
 
 @dataclass(eq=False, frozen=True)
@@ -243,8 +383,8 @@ class BooleanItem(ModelItem):
     value_false: str = "0"
 
     def transform(self, s: pd.Series) -> Union[pd.Series, pd.DataFrame]:
-        self._validate()
-        return s.str.strip().map({self.value_true: True, self.value_false: False})
+        values = s.str.strip().map({self.value_true: True, self.value_false: False})
+        return values.astype(pd.CategoricalDtype([False, True]))
 
 
 @dataclass(eq=False, frozen=True)
@@ -252,5 +392,4 @@ class InvokeItem(Item):
     handler: Callable
 
     def transform(self, s: pd.Series) -> Union[pd.Series, pd.DataFrame]:
-        self._validate()
         return self.handler(s)
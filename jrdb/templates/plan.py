@@ -0,0 +1,222 @@
+import dataclasses
+import hashlib
+from types import CodeType, MappingProxyType
+from typing import Any, Callable, List, Mapping, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .item import ArrayItem, InvokeItem, Item, ModelItem
+
+# Bump when item or template transforms change their output, to invalidate cached
+# transforms (3: SED race modes are grouped by the full program key)
+PLAN_VERSION = 3
+
+
+class Column(NamedTuple):
+    """
+    Everything needed to cut one item out of a record array and transform it
+    """
+
+    item: Item
+    key: str
+    start: int
+    width: int
+    # fixed width bytes dtype of a single cell and the number of cells per row,
+    # () for scalar items and (size,) for array items
+    dtype: str
+    shape: Tuple[int, ...]
+    encoding: Optional[str]
+    # (model, field name) the item is stored in, None for items without a model
+    field: Optional[Tuple[Any, str]]
+    transform: Callable
+    # whether transform maps every cell independently of the others, so that it can
+    # be run on unique cells only (array cells are not hashable, handlers are opaque)
+    elementwise: bool
+
+    @property
+    def ndarray(self) -> bool:
+        """
+        Whether the cells are handed to transform as an ndarray (encoding-less items
+        as fixed width bytes, array items as (rows, size) arrays) rather than as a
+        Series of python objects
+        """
+        return bool(self.shape) or not self.encoding
+
+    @classmethod
+    def compile(cls, item: Item) -> "Column":
+        item.validate()
+
+        if isinstance(item, ArrayItem):
+            dtype, shape = f"S{item.element_width}", (item.size,)
+        else:
+            dtype, shape = f"S{item.width}", ()
+
+        field = None
+        if isinstance(item, ModelItem):
+            field = (item.get_model(), item.get_field().name)
+
+        return cls(
+            item=item,
+            key=item.key,
+            start=item.start,
+            width=item.width,
+            dtype=dtype,
+            shape=shape,
+            encoding=item.encoding,
+            field=field,
+            transform=item.transform,
+            elementwise=not isinstance(item, (ArrayItem, InvokeItem)),
+        )
+
+    def view(self, records: np.ndarray) -> np.ndarray:
+        """
+        Zero-copy view of the raw bytes of this column in every record
+
+        Array items are returned with shape (rows, size, element width)
+        """
+        cells = records[:, self.start : self.start + self.width]
+        return cells.reshape(len(cells), *self.shape, -1) if self.shape else cells
+
+    def transform_unique(self, cells: Any) -> Union[pd.Series, pd.DataFrame]:
+        """
+        transform the unique cells only and broadcast the result to every row
+
+        Falls back to transform for items that are not elementwise and for Series
+        with missing cells, which factorize cannot round trip
+        """
+        if not self.elementwise:
+            return self.transform(cells)
+
+        if isinstance(cells, np.ndarray):
+            uniques, codes = np.unique(cells, return_inverse=True)
+            transformed = self.transform(uniques).take(codes)
+            transformed.index = pd.RangeIndex(len(cells))
+            return transformed
+
+        codes, uniques = pd.factorize(cells)
+        if (codes == -1).any():
+            return self.transform(cells)
+
+        transformed = self.transform(pd.Series(uniques, name=cells.name)).take(codes)
+        transformed.index = cells.index
+        return transformed
+
+    def extract(self, records: np.ndarray) -> Union[np.ndarray, pd.Series]:
+        """
+        The cells of this column in every record, as transform takes them (see
+        ndarray)
+        """
+        cells = slice_records(records, self.start, self.width).view(self.dtype)
+        if self.shape:
+            cells = cells.reshape(-1, *self.shape)
+        if self.encoding:
+            cells = np.char.decode(cells, encoding=self.encoding)
+        if self.ndarray:
+            return cells
+        return pd.Series(cells.astype(object), name=self.key)
+
+    def to_series(self, cells: Union[np.ndarray, pd.Series]) -> pd.Series:
+        """
+        Extracted cells as a Series of python objects (bytes, str or row arrays)
+        """
+        if not self.ndarray:
+            return cells
+        values = list(cells) if self.shape else cells.astype(object)
+        return pd.Series(values, name=self.key, dtype=object)
+
+    def from_series(self, s: pd.Series) -> Union[np.ndarray, pd.Series]:
+        """
+        The inverse of to_series, for cells read back from a DataFrame
+        """
+        if not self.ndarray:
+            return s
+        dtype = f"U{self.dtype[1:]}" if self.encoding else self.dtype
+        return np.array(s.tolist(), dtype=dtype).reshape(-1, *self.shape)
+
+
+class Plan(NamedTuple):
+    """
+    The items of a template compiled into an immutable table of columns
+
+    Compiling validates the items and resolves their keys, offsets, encodings and
+    model fields once, so a plan can be built per template class and reused for
+    every file it reads.
+    """
+
+    columns: Tuple[Column, ...]
+    by_key: Mapping[str, Column]
+    # digest of PLAN_VERSION and every item definition
+    version: str
+
+    @classmethod
+    def compile(cls, items: List[Item]) -> "Plan":
+        columns = tuple(Column.compile(item) for item in items)
+        by_key = MappingProxyType({column.key: column for column in columns})
+
+        digest = hashlib.sha1(str(PLAN_VERSION).encode())
+        for item in items:
+            digest.update(describe_item(item).encode())
+
+        return cls(columns=columns, by_key=by_key, version=digest.hexdigest())
+
+    @property
+    def keys(self) -> List[str]:
+        return [column.key for column in self.columns]
+
+
+def describe_item(item: Item) -> str:
+    """
+    A repr of item that is stable across processes (see describe_value)
+    """
+    values = [describe_value(getattr(item, f.name)) for f in dataclasses.fields(item)]
+    return f"{item.__class__.__name__}({', '.join(values)})"
+
+
+def describe_value(value: Any) -> str:
+    """
+    repr of value, except for callables which are described by their qualified
+    name and, for python functions, their code (see describe_code), recursing into
+    dicts, lists and tuples
+    """
+    if isinstance(value, dict):
+        items = [f"{key!r}: {describe_value(v)}" for key, v in value.items()]
+        return f"{{{', '.join(items)}}}"
+    if isinstance(value, (list, tuple)):
+        return f"[{', '.join(describe_value(v) for v in value)}]"
+    if callable(value):
+        name = f"{value.__module__}.{value.__qualname__}"
+        code = getattr(value, "__code__", None)
+        return f"{name}:{describe_code(code)}" if code else name
+    return repr(value)
+
+
+def describe_code(code: CodeType) -> str:
+    """
+    The bytecode, constants and names of code, so that editing a function (e.g. the
+    factor of a mapper lambda) changes its description while its name does not
+    """
+    consts = [describe_const(const) for const in code.co_consts]
+    return f"{code.co_code.hex()}({', '.join(consts)}; {', '.join(code.co_names)})"
+
+
+def describe_const(const: Any) -> str:
+    if isinstance(const, CodeType):
+        return describe_code(const)
+    if isinstance(const, frozenset):
+        # e.g. `x in {"a", "b"}`, whose repr follows the per process string hashes
+        return f"frozenset({sorted(map(describe_const, const))})"
+    if isinstance(const, tuple):
+        return f"({', '.join(map(describe_const, const))})"
+    return repr(const)
+
+
+def slice_records(records: np.ndarray, start: int, width: int) -> np.ndarray:
+    """
+    Copy bytes [start, start + width) of every record into a 1d array of byte
+    strings, padding records that end before the slice does
+    """
+    cells = np.zeros((len(records), width), dtype=np.uint8)
+    chunk = records[:, start : start + width]
+    cells[:, : chunk.shape[1]] = chunk
+    return cells.view(f"S{width}").ravel()
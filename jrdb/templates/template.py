@@ -1,107 +1,627 @@
+import glob
+import hashlib
+import mmap
 import os
 import re
+import zipfile
 from abc import ABC
-from typing import List, Any, Union
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from fnmatch import fnmatch
+from functools import lru_cache, partial
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
 
+import django
 import numpy as np
 import pandas as pd
+from django.conf import settings
+from django.db import connections
 from django.utils.functional import cached_property
 from django.utils.module_loading import import_string
 
-from .item import ArrayItem
+from ..store import store
+from .cache import TransformCache
+from .item import ForeignKeyItem, Item
+from .plan import Plan, describe_value
+
+
+ARCHIVE_SEP = "::"
+# class attributes and methods whose value changes the output of transform, see
+# Template.transform_version
+TRANSFORM_ATTRIBUTES = [
+    "transform_requires",
+    "dedupe_transform",
+    "race_by",
+    "race_aggregates",
+]
+TRANSFORM_METHODS = ["transform", "transform_column", "aggregate_races"]
+# bytes of records checked at once by record_layout
+LAYOUT_BLOCK_BYTES = 2 ** 20
 
 
 class Template(ABC):
     description = ""
     items = []
+    # item keys whose rows must stay in the same chunk (see iter_chunks)
+    chunk_by: List[str] = []
+    # item keys read by the template's own transform (see resolve_items)
+    transform_requires: List[str] = []
+    # transform only the unique cells of every column and broadcast the results,
+    # for templates whose rows repeat most values (e.g. race fields of contenders)
+    dedupe_transform: bool = False
+    # transformed columns identifying the race of a row and {column: aggregate} of
+    # race level columns to replace by an aggregate over every row (e.g. contender)
+    # of the race, such as group_mode (see aggregate_races)
+    race_by: List[str] = []
+    race_aggregates: Dict[str, Callable] = {}
+    # keyword arguments of every loader, e.g. batch_rows or batch_bytes
+    loader_options: Dict[str, Any] = {}
 
-    def __init__(self, path):
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        counts = Counter(item.key for item in cls.items)
+        duplicates = [key for key, count in counts.items() if count > 1]
+        assert not duplicates, f"duplicate item keys <{cls.__name__}: {duplicates}>"
+
+    def __init__(
+        self,
+        path,
+        memory_map: bool = False,
+        cache_dir: str = None,
+        transform_workers: int = None,
+    ):
         self.path = path
-        self.df = None
+        self.memory_map = memory_map
+        self.cache_dir = cache_dir
+        self.transform_workers = transform_workers
+        # extracted cells by item key, see Column.extract
+        self.cells: Optional[Dict[str, Any]] = None
+        self._df = None
 
     @cached_property
     def loader_cls(self):
-        # TODO: Lazy load to prevent import errors
-        from ..loaders import DjangoPostgresUpsertLoader
-
-        return DjangoPostgresUpsertLoader
+        # imported lazily to prevent circular imports
+        loader_cls = import_string(settings.JRDB_LOADER)
+        if self.loader_options:
+            return partial(loader_cls, **self.loader_options)
+        return loader_cls
 
-    def extract(self) -> "Template":
+    def extract(self, columns: List[str] = None) -> "Template":
         """
         Extract contents of self.path into DataFrame
 
-        Using the slightly slower np.char.decode(byterows, encoding='cp932') rather than decoding
-        each cell individually to make parsing less of a hassle for subclasses
+        The file is read into a single buffer and viewed as a 2d array of records so
+        that each item is sliced for every row at once. Cells are decoded with
+        item.encoding into self.cells; numeric and date items keep theirs as fixed
+        width bytes arrays, which are pure ASCII and parsed without going through
+        cp932 or python objects (see df)
+
+        Pass `columns` (item keys) to extract, and later transform, only the items
+        returned by resolve_items(columns). Projected templates are meant for
+        analysis; load() expects every item to be present.
+
+        When cache_dir is set the transform is computed right away and cached (see
+        TransformCache). On a cache hit both extract and transform are skipped and
+        self.cells and self.df are left empty.
         """
-        with open(self.path, "rb") as f:
-            rows = []
-            lines = filter(None, f.read().splitlines())
-            for line in lines:
-                row = []
-                for item in self.items:
-                    lst_bytes = self._extract_item(line, item)
-                    lst_str = np.char.decode(lst_bytes, encoding="cp932")
-                    if len(lst_str) == 1:
-                        row.append(lst_str[0])
-                    else:
-                        row.append(lst_str)
-                rows.append(row)
-        self.df = pd.DataFrame(rows, columns=[item.key for item in self.items])
+        if self.cache and columns is None:
+            cached = self.cache.get()
+            if cached is not None:
+                self.transform = cached
+                return self
+
+        plan = self.plan()
+        keys = plan.keys
+        if columns is not None:
+            keys = [item.key for item in self.resolve_items(columns)]
+        self.cells = {key: plan.by_key[key].extract(self.records) for key in keys}
+        self._df = None
+
+        if self.cache and columns is None:
+            self.cache.set(self.transform)
         return self
 
-    def _extract_item(self, line: bytes, item: Any) -> List[bytes]:
-        row = []
-        if isinstance(item, ArrayItem):
-            for i in range(item.size):
-                start = item.start + (item.element_width * i)
-                stop = start + item.element_width
-                cell = line[start:stop]
-                row.append(cell)
-        else:
-            stop = item.start + item.width
-            cell = line[item.start : stop]
-            row.append(cell)
-        return row
+    @property
+    def df(self) -> Optional[pd.DataFrame]:
+        """
+        The extracted cells as a DataFrame of python objects, built on first access
+
+        transform reads self.cells and never builds this frame. Assigning a frame,
+        e.g. a subset of the rows of df, makes transform read its cells instead.
+        """
+        if self._df is None and self.cells is not None:
+            plan = self.plan()
+            self._df = pd.DataFrame(
+                {
+                    key: plan.by_key[key].to_series(cells)
+                    for key, cells in self.cells.items()
+                },
+                columns=list(self.cells),
+            )
+        return self._df
+
+    @df.setter
+    def df(self, df: Optional[pd.DataFrame]) -> None:
+        self._df = df
+        self.cells = None
+
+    @cached_property
+    def cache(self) -> Optional[TransformCache]:
+        return TransformCache(self.cache_dir, self) if self.cache_dir else None
+
+    @classmethod
+    def plan(cls) -> Plan:
+        """
+        The compiled plan of cls.items, built on first use and cached on the class
+        """
+        if "_plan" not in cls.__dict__:
+            cls._plan = Plan.compile(cls.items)
+        return cls._plan
+
+    @classmethod
+    def transform_version(cls) -> str:
+        """
+        Digest of the plan version, the TRANSFORM_ATTRIBUTES of cls and the code of
+        the TRANSFORM_METHODS it overrides, which keys cached transforms
+        """
+        if "_transform_version" not in cls.__dict__:
+            digest = hashlib.sha1(cls.plan().version.encode())
+            for name in TRANSFORM_ATTRIBUTES:
+                digest.update(f"{name}={describe_value(getattr(cls, name))}".encode())
+            for klass in cls.__mro__[: cls.__mro__.index(Template)]:
+                for name in TRANSFORM_METHODS:
+                    if name in klass.__dict__:
+                        method = klass.__dict__[name]
+                        method = getattr(method, "func", method)
+                        digest.update(f"{name}={describe_value(method)}".encode())
+            cls._transform_version = digest.hexdigest()
+        return cls._transform_version
+
+    @classmethod
+    def preload(cls) -> None:
+        """
+        Compile the plan of cls and load the lookups of its foreign keys, e.g. before
+        forking workers so that they inherit both
+        """
+        for column in cls.plan().columns:
+            if isinstance(column.item, ForeignKeyItem):
+                column.item.preload()
+
+    def resolve_items(self, columns: List[str]) -> List[Item]:
+        """
+        Items needed to extract `columns`, in template order
+
+        Besides the requested items these are the items holding the unique keys of
+        every model the requested items belong to (following foreign keys to the keys
+        of the related model, e.g. contender -> race -> program) so that rows can be
+        joined with other files, and the items listed in transform_requires.
+        """
+        plan = self.plan()
+        keys = set(columns) | set(self.transform_requires)
+        unknown = keys - set(plan.by_key)
+        assert not unknown, f"unknown columns <{', '.join(sorted(unknown))}>"
+
+        unique_fields = set()
+        for key in keys:
+            if plan.by_key[key].field:
+                model, _ = plan.by_key[key].field
+                unique_fields |= get_unique_fields(model)
+
+        return [
+            column.item
+            for column in plan.columns
+            if column.key in keys or column.field in unique_fields
+        ]
+
+    @cached_property
+    def records(self) -> np.ndarray:
+        """
+        Contents of self.path as a 2d uint8 array of shape (rows, record width)
+
+        When memory_map is set the file is mapped rather than read, so the array
+        (and every column sliced from it) is a view over the OS page cache rather
+        than a copy on the heap. Archive members (see split_archive_path) are
+        decompressed straight from the archive.
+        """
+        archive, member = split_archive_path(self.path)
+        if archive:
+            with zipfile.ZipFile(archive) as zf:
+                return to_records(zf.read(member))
+
+        with open(self.path, "rb") as f:
+            if self.memory_map and os.fstat(f.fileno()).st_size:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buf = f.read()
+        return to_records(buf)
+
+    @cached_property
+    def layout(self) -> Optional[Tuple[int, int]]:
+        """
+        (record width, stride) of self.path when its records are viewed in place
+        (see record_layout), None for archive members and irregular files
+        """
+        archive, _ = split_archive_path(self.path)
+        # records viewed in place skip the terminator of every row, while padded
+        # records are contiguous
+        stride, width = self.records.strides[0], self.records.shape[1]
+        return (width, stride) if not archive and stride > width > 0 else None
+
+    def column(self, key: str) -> np.ndarray:
+        """
+        Zero-copy view of the raw bytes of an item in every record
+
+        Array items are returned with shape (rows, size, element width)
+        """
+        return self.plan().by_key[key].view(self.records)
 
     @cached_property
     def transform(self) -> pd.DataFrame:
-        objs = []
-        for col in self.df:
-            item = next(item for item in self.items if item.key == col)
-            objs.append(item.transform(self.df[col]))
-        return pd.concat(objs, axis="columns")
+        """
+        Transform every extracted column and concatenate them in order
 
-    def load(self) -> None:
-        pass
+        With transform_workers set, columns are transformed by that many threads,
+        which overlap where item transforms release the GIL (numpy and pandas)
+        """
+        keys = list(self.cells if self.cells is not None else self.df)
+        if self.transform_workers:
+            with ThreadPoolExecutor(self.transform_workers) as executor:
+                objs = list(executor.map(self._transform_column_in_thread, keys))
+        else:
+            objs = [self.transform_column(key) for key in keys]
+        return pd.concat(objs, axis="columns").pipe(self.aggregate_races)
+
+    def transform_column(self, key: str) -> Union[pd.Series, pd.DataFrame]:
+        column = self.plan().by_key[key]
+        if self.cells is not None:
+            cells = self.cells[key]
+        else:
+            cells = column.from_series(self.df[key])
+
+        if self.dedupe_transform:
+            transformed = column.transform_unique(cells)
+        else:
+            transformed = column.transform(cells)
+
+        if self.cells is None:
+            transformed.index = self.df.index
+        return transformed
 
+    def _transform_column_in_thread(self, key: str) -> Union[pd.Series, pd.DataFrame]:
+        try:
+            return self.transform_column(key)
+        finally:
+            # database connections are per thread, e.g. foreign key lookups
+            connections.close_all()
 
-def startswith(
-    f: Union[pd.Series, pd.DataFrame], prefix: str, rename: bool = False
-) -> Union[pd.Series, pd.DataFrame]:
-    f = f.copy()
-    axis = "columns" if isinstance(f, pd.DataFrame) else "index"
-    names = [name for name in getattr(f, axis) if name.startswith(prefix)]
-    f = f[names]
-    if rename:
-        f = f.rename(
+    def aggregate_races(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Replace every column of race_aggregates by aggregate(df, race_by, column)
+
+        Columns missing from df, e.g. when extracting only some columns, are skipped.
+        df is returned as is when there is nothing to replace, as assign copies it.
+        """
+        aggregates = {
+            col: aggregate
+            for col, aggregate in self.race_aggregates.items()
+            if col in df.columns
+        }
+        if not aggregates or not set(self.race_by) <= set(df.columns):
+            return df
+        return df.assign(
             **{
-                axis: lambda name: name[len(prefix) :]
-                if name.startswith(prefix)
-                else name
+                col: aggregate(df, self.race_by, col)
+                for col, aggregate in aggregates.items()
             }
         )
-    f.prefix = prefix
-    return f
+
+    @cached_property
+    def column_groups(self) -> Dict[str, List[int]]:
+        """
+        Positions of the transformed columns by model prefix, e.g. race -> race__*
+        """
+        groups: Dict[str, List[int]] = {}
+        for position, name in enumerate(self.transform.columns):
+            prefix, sep, _ = name.partition("__")
+            if sep:
+                groups.setdefault(prefix, []).append(position)
+        return groups
+
+    def group(self, prefix: str) -> pd.DataFrame:
+        """
+        The transformed columns of a model prefix, renamed without the prefix
+
+        Only the columns of the group are taken out of the transform, which is never
+        copied as a whole, so the group can be mutated (e.g. to add foreign keys)
+        without affecting the transform or other groups.
+        """
+        df = self.transform.take(self.column_groups.get(prefix, []), axis=1)
+        df.columns = [name[len(prefix) + 2 :] for name in df.columns]
+        return df
+
+    def load(self) -> None:
+        pass
+
+    def iter_chunks(self, rows: int, columns: List[str] = None) -> Iterator["Template"]:
+        """
+        Yield extracted templates over consecutive slices of at most `rows` records
+
+        Each chunk is a template of the same class, so chunk.transform and
+        chunk.load() behave as they would for the whole file while only one chunk is
+        decoded at a time. Boundaries are pushed forward so that records with equal
+        `chunk_by` values are never split between chunks.
+        """
+        for start, stop in self._chunk_bounds(rows):
+            chunk = self.__class__(
+                self.path,
+                memory_map=self.memory_map,
+                transform_workers=self.transform_workers,
+            )
+            chunk.records = self.records[start:stop]
+            yield chunk.extract(columns)
+
+    def load_chunks(self, rows: int) -> None:
+        """
+        Load the file chunk by chunk, transforming the next chunk while the previous
+        one is being written to the database
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = None
+            for chunk in self.iter_chunks(rows):
+                chunk.transform
+                if future:
+                    future.result()
+                future = executor.submit(chunk.load)
+            if future:
+                future.result()
+
+    def extract_parallel(
+        self, workers: int = None, columns: List[str] = None
+    ) -> "Template":
+        """
+        Extract and transform self.path in a pool of `workers` processes
+
+        The records are split into one shard per worker along the same boundaries as
+        iter_chunks. Each worker maps only the bytes of its own shard (see layout)
+        and extracts and transforms it, so only (path, start, stop) is sent to it
+        and only the transform is sent back; the records of archive members and
+        irregular files, which cannot be mapped, are sent instead.
+        The transforms are concatenated in order into self.transform and self.df
+        is left empty.
+        """
+        if self.cache and columns is None:
+            cached = self.cache.get()
+            if cached is not None:
+                self.transform = cached
+                return self
+
+        workers = workers or os.cpu_count()
+        rows = -(-len(self.records) // workers)
+        bounds = list(self._chunk_bounds(rows)) if rows else []
+        if workers == 1 or len(bounds) < 2:
+            return self.extract(columns)
+
+        # forked workers inherit the lookups but must open their own connections
+        self.preload()
+        connections.close_all()
+        store.dispose()
+
+        layout = self.layout
+        with ProcessPoolExecutor(workers, initializer=django.setup) as executor:
+            futures = [
+                executor.submit(
+                    extract_transform_shard,
+                    self.__class__,
+                    self.path,
+                    start,
+                    stop,
+                    columns,
+                    layout,
+                    None if layout else self.records[start:stop],
+                )
+                for start, stop in bounds
+            ]
+            self.transform = pd.concat([future.result() for future in futures])
+
+        if self.cache and columns is None:
+            self.cache.set(self.transform)
+        return self
+
+    def _chunk_bounds(self, rows: int) -> Iterator[Tuple[int, int]]:
+        assert rows > 0, "rows must be greater than 0"
+        n = len(self.records)
+        changes = None
+        if self.chunk_by:
+            keys = np.hstack([self.column(key).reshape(n, -1) for key in self.chunk_by])
+            changes = np.flatnonzero((keys[1:] != keys[:-1]).any(axis=1)) + 1
+
+        start = 0
+        while start < n:
+            stop = min(start + rows, n)
+            if changes is not None and stop < n:
+                i = np.searchsorted(changes, stop)
+                stop = changes[i] if i < len(changes) else n
+            yield start, int(stop)
+            start = stop
 
 
-def template_factory(path: str) -> Template:
+def extract_transform_shard(
+    cls: Any,
+    path: str,
+    start: int,
+    stop: int,
+    columns: List[str] = None,
+    layout: Tuple[int, int] = None,
+    records: np.ndarray = None,
+) -> pd.DataFrame:
+    """
+    Transform records [start, stop) of path, indexed by their position in the file
+
+    The records are mapped from path with layout (record width, stride) unless
+    they are passed as is
+    """
+    template = cls(path)
+    if records is None:
+        records = map_records(path, start, stop, *layout)
+    template.records = records
+    transform = template.extract(columns).transform
+    transform.index += start
+    return transform
+
+
+def get_unique_fields(model: Any) -> Set[Tuple[Any, str]]:
+    """
+    (model, field name) pairs identifying a row of model, following relations in
+    unique_together to the fields identifying the related row
+    """
+    fields = set()
+    for name in (model._meta.unique_together or [()])[0]:
+        fields.add((model, name))
+        field = model._meta.get_field(name)
+        if field.is_relation:
+            fields |= get_unique_fields(field.related_model)
+    return fields
+
+
+def to_records(buf: bytes) -> np.ndarray:
+    """
+    View the lines of buf as a 2d uint8 array of shape (rows, record width)
+
+    JRDB records are fixed width, so when every line is followed by the same
+    terminator (see record_layout) the buffer is reshaped in place. Irregular files
+    fall back to splitting lines and padding the short ones with NUL bytes, which
+    numpy strips from fixed width byte strings.
+    """
+    layout = record_layout(buf)
+    if layout:
+        width, stride = layout
+        return np.frombuffer(buf, dtype=np.uint8).reshape(-1, stride)[:, :width]
+
+    lines = [line for line in bytes(buf).splitlines() if line]
+    width = max(map(len, lines), default=0)
+    if not width:
+        return np.empty((len(lines), 0), dtype=np.uint8)
+    return np.array(lines, dtype=f"S{width}").view(np.uint8).reshape(-1, width)
+
+
+def map_records(
+    path: str, start: int, stop: int, width: int, stride: int
+) -> np.ndarray:
+    """
+    Map records [start, stop) of a file of fixed width records (see record_layout)
+    without reading, or checking, the rest of the file
+    """
+    with open(path, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    data = np.frombuffer(
+        buf, dtype=np.uint8, count=(stop - start) * stride, offset=start * stride
+    )
+    return data.reshape(-1, stride)[:, :width]
+
+
+def record_layout(buf: bytes) -> Optional[Tuple[int, int]]:
+    """
+    (record width, stride) of buf when every line is followed by the same
+    terminator and no record contains a line break, else None
+
+    Records are checked in blocks of about LAYOUT_BLOCK_BYTES so that the masks
+    stay small however large the (memory-mapped) buffer is.
+    """
+    eol = re.search(rb"[\r\n]+", buf)
+    if not (eol and eol.start() > 0 and len(buf) % eol.end() == 0):
+        return None
+
+    width, stride = eol.start(), eol.end()
+    records = np.frombuffer(buf, dtype=np.uint8).reshape(-1, stride)
+    terminator = records[0, width:]
+    step = max(LAYOUT_BLOCK_BYTES // stride, 1)
+    for start in range(0, len(records), step):
+        block = records[start : start + step]
+        body = block[:, :width]
+        if not (block[:, width:] == terminator).all():
+            return None
+        if ((body == ord("\r")) | (body == ord("\n"))).any():
+            return None
+    return width, stride
+
+
+def group_mode(df: pd.DataFrame, by: List[str], col: str) -> pd.Series:
+    """
+    The mode of col over each group of rows with equal `by` values, for every row
+
+    Ties are broken by the smallest value, as Series.mode().iloc[0] does. Rows of
+    groups without a value and rows with missing keys keep their own value.
+    """
+    counts = df.groupby(by + [col], observed=True).size().rename("_count")
+    modes = (
+        counts.reset_index()
+        .sort_values(["_count", col], ascending=[False, True], kind="mergesort")
+        .drop_duplicates(by)
+    )
+    mode = df[by].merge(modes[by + [col]], how="left", on=by)[col]
+    mode.index = df.index
+    return mode.where(mode.notna(), df[col])
+
+
+def template_factory(path: str, **kwargs) -> Template:
     name = extract_template_name(path)
     module_path = ".".join(["jrdb", "templates", name])
-    return import_string(module_path)(path)
+    return import_string(module_path)(path, **kwargs)
 
 
 def extract_template_name(path):
-    basename = os.path.basename(path)
+    _, member = split_archive_path(path)
+    basename = os.path.basename(member)
     filename, _ = os.path.splitext(basename)
     name = re.search("[A-Z]+", filename).group()
     return name
+
+
+def split_archive_path(path: str) -> Tuple[Optional[str], str]:
+    """
+    Split "archive.zip::member.txt" into ("archive.zip", "member.txt")
+
+    Paths that do not point into an archive are returned as (None, path)
+    """
+    archive, sep, member = path.partition(ARCHIVE_SEP)
+    return (archive, member) if sep else (None, path)
+
+
+def glob_paths(pattern: str) -> List[str]:
+    """
+    glob.glob that looks inside zip archives
+
+    Archives matched by pattern are expanded into one "archive.zip::member" path per
+    member, and "archive.zip::member pattern" only matches the members of the
+    archives that fit the member pattern.
+    """
+    archive_pattern, _, member_pattern = pattern.partition(ARCHIVE_SEP)
+    paths = []
+    for path in glob.glob(archive_pattern):
+        if not (member_pattern or path.lower().endswith(".zip")):
+            paths.append(path)
+            continue
+        with zipfile.ZipFile(path) as zf:
+            members = [name for name in zf.namelist() if not name.endswith("/")]
+        paths.extend(
+            ARCHIVE_SEP.join([path, member])
+            for member in members
+            if fnmatch(os.path.basename(member), member_pattern or "*")
+        )
+    return paths
+
+
+def get_file_size(path: str) -> int:
+    """
+    Size in bytes of a file or of an archive member once decompressed
+    """
+    archive, member = split_archive_path(path)
+    if archive:
+        return get_archive_sizes(archive)[member]
+    return os.path.getsize(path)
+
+
+@lru_cache(maxsize=None)
+def get_archive_sizes(archive: str) -> Dict[str, int]:
+    with zipfile.ZipFile(archive) as zf:
+        return {info.filename: info.file_size for info in zf.infolist()}
@@ -5,6 +5,7 @@ from django.core.management import call_command
 from django.test import TransactionTestCase
 
 from jrdb.store import store
+from jrdb.templates.item import clear_related_ids
 
 SAMPLES_DIR = os.path.join(settings.BASE_DIR, "jrdb", "tests", "samples")
 
@@ -35,10 +36,15 @@ class JRDBTestCase(TransactionTestCase):
     def setUpTestData(cls):
         pass
 
+    def _pre_setup(self):
+        # every test starts from an empty database, so cached ids may be stale
+        clear_related_ids()
+        super()._pre_setup()
+
     @classmethod
     def tearDownClass(cls):
         super().tearDownClass()
-        store.engine.dispose()
+        store.dispose()
 
     def assertSubDict(self, sub, sup):
         diff = [key for key in sub if (key in sup and not sup[key] == sub[key])]
@@ -0,0 +1,74 @@
+import os
+
+import pandas as pd
+from django.test import override_settings
+from sqlalchemy import false
+
+from jrdb.loaders import DjangoPostgresUpsertLoader, copy_text
+from jrdb.models import Contender
+from jrdb.templates import SED
+from jrdb.tests.base import JRDBTestCase, SAMPLES_DIR
+
+
+class LoaderTestCase(JRDBTestCase):
+    fixtures = ["pace_flow_code", "race_condition_code", "racetrack"]
+
+    def test_copy_load_equals_upsert_load(self):
+        template_path = os.path.join(SAMPLES_DIR, "SED080913.txt")
+
+        with override_settings(JRDB_LOADER="jrdb.loaders.DjangoPostgresCopyLoader"):
+            SED(template_path).extract().load()
+        exp = list(Contender.objects.order_by("id").values())
+
+        # overwrites every column that was copied
+        SED(template_path).extract().load()
+        act = list(Contender.objects.order_by("id").values())
+
+        self.assertEqual(len(exp), 324)
+        self.assertEqual(act, exp)
+
+    def test_load_returns_ids_of_skipped_rows(self):
+        template_path = os.path.join(SAMPLES_DIR, "SED080913.txt")
+        df = SED(template_path).extract().group("program")
+
+        exp = DjangoPostgresUpsertLoader(df, "jrdb.Program").load()
+        act = DjangoPostgresUpsertLoader(df, "jrdb.Program").load(
+            where=lambda stmt: false()
+        )
+
+        self.assertEqual(len(act.index), len(df.drop_duplicates().index))
+        pd.testing.assert_frame_equal(
+            act.sort_values("id").reset_index(drop=True),
+            exp.sort_values("id").reset_index(drop=True),
+        )
+
+    def test_batched_load_equals_load(self):
+        template_path = os.path.join(SAMPLES_DIR, "SED080913.txt")
+        df = SED(template_path).extract().group("horse")
+
+        exp = DjangoPostgresUpsertLoader(df, "jrdb.Horse").load()
+        act = DjangoPostgresUpsertLoader(
+            df, "jrdb.Horse", batch_rows=50, target_seconds=0.001
+        ).load()
+
+        self.assertEqual(len(act.index), len(exp.index))
+        pd.testing.assert_frame_equal(
+            act.sort_values("id").reset_index(drop=True),
+            exp.sort_values("id").reset_index(drop=True),
+        )
+
+    def test_zero_batch_bounds_disable_batching(self):
+        template_path = os.path.join(SAMPLES_DIR, "SED080913.txt")
+        df = SED(template_path).extract().group("horse")
+
+        with override_settings(JRDB_LOADER_BATCH_ROWS=50, JRDB_LOADER_BATCH_BYTES=1):
+            loader = DjangoPostgresUpsertLoader(
+                df, "jrdb.Horse", batch_rows=0, batch_bytes=0
+            )
+        self.assertEqual(loader._batch_rows(), len(loader._data.index))
+
+    def test_copy_text(self):
+        self.assertEqual(copy_text(None), "\\N")
+        self.assertEqual(copy_text(True), "t")
+        self.assertEqual(copy_text("a\tb\\"), "a\\tb\\\\")
+        self.assertEqual(copy_text([1, None, 'x"']), '{"1",NULL,"x\\\\""}')
@@ -0,0 +1,61 @@
+import os
+from unittest import mock
+
+from sqlalchemy import MetaData, Table
+
+from jrdb.models import Contender
+from jrdb.store import FIELD_TYPE_MAP, SQLAlchemyModelStore, model_table, store
+from jrdb.tests.base import JRDBTestCase
+
+
+class StoreTestCase(JRDBTestCase):
+    def test_model_tables_match_reflected_tables(self):
+        meta = MetaData()
+        for db_table in store.models:
+            exp = Table(db_table, meta, autoload=True, autoload_with=store.engine)
+            act = store[db_table]
+            self.assertIs(store[db_table], act)
+            self.assertEqual(
+                sorted((c.name, c.type.python_type, c.primary_key) for c in act.c),
+                sorted((c.name, c.type.python_type, c.primary_key) for c in exp.c),
+            )
+
+    def test_models_with_unmapped_field_types_are_reflected(self):
+        db_table = Contender._meta.db_table
+        with mock.patch.dict(FIELD_TYPE_MAP):
+            del FIELD_TYPE_MAP["FloatField"]
+            self.assertIsNone(model_table(Contender, MetaData()))
+
+            other = SQLAlchemyModelStore()
+            other.engine = store.engine
+            act = other[db_table]
+
+        self.assertEqual(
+            sorted((c.name, c.type.python_type) for c in act.c),
+            sorted((c.name, c.type.python_type) for c in store[db_table].c),
+        )
+
+    def test_fork_hook_is_registered_for_store_only(self):
+        other = SQLAlchemyModelStore()
+        other.engine = parent_engine = store.engine
+
+        pid = os.fork()
+        if pid == 0:
+            inherited = "engine" in store.__dict__, other.engine is parent_engine
+            os._exit(0 if inherited == (False, True) else 1)
+
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+
+    def test_forked_child_creates_its_own_engine(self):
+        parent_engine = store.engine
+        with parent_engine.connect() as conn:
+            conn.execute("SELECT 1")
+
+        store._after_fork_in_child()
+        self.addCleanup(parent_engine.dispose)
+        self.addCleanup(store._inherited.remove, parent_engine)
+
+        self.assertIsNot(store.engine, parent_engine)
+        self.assertIn(parent_engine, store._inherited)
+        self.assertEqual(store.pool_status()["checked_out"], 0)
@@ -1,7 +1,34 @@
+import mmap
 import os
+import tempfile
+import tracemalloc
+import zipfile
+from unittest import mock
 
-from jrdb.models import Race
-from jrdb.templates import BAC
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase
+from django.utils.functional import cached_property
+
+from jrdb.checks import check_templates
+from jrdb.models import Race, Racetrack
+from jrdb.templates import BAC, KSA, KZA, KYI, OZ, SED
+from jrdb.templates.item import (
+    ArrayItem,
+    FloatItem,
+    IntegerItem,
+    clear_related_ids,
+    get_related_ids,
+)
+from jrdb.templates.plan import Plan, describe_item
+from jrdb.templates.template import (
+    Template,
+    glob_paths,
+    template_factory,
+    group_mode,
+    map_records,
+    to_records,
+)
 from jrdb.tests.base import JRDBTestCase, SAMPLES_DIR
 
 
@@ -29,3 +56,330 @@ class TemplateTestCase(JRDBTestCase):
         act_count = Race.objects.count()
 
         self.assertEqual(act_count, exp_count)
+
+    def test_choice_items_are_categorical(self):
+        template_path = os.path.join(SAMPLES_DIR, "BAC080913.txt")
+        t = BAC(template_path).extract()
+        t.load()
+
+        self.assertEqual(str(t.transform["race__surface"].dtype), "category")
+        self.assertEqual(str(t.transform["race__sold_win"].dtype), "category")
+
+        exp = t.transform["race__surface"].astype(object).tolist()
+        df = Race.objects.order_by("id").to_dataframe()
+        self.assertEqual(str(df["surface"].dtype), "category")
+        self.assertEqual(df["surface"].astype(object).tolist(), exp)
+
+    def test_group_is_independent_of_transform(self):
+        template_path = os.path.join(SAMPLES_DIR, "BAC080913.txt")
+        t = BAC(template_path).extract()
+        exp = t.transform["race__num"].copy()
+
+        race = t.group("race")
+        race["num"] = 0
+
+        cols = [name for name in t.transform.columns if name.startswith("race__")]
+        self.assertEqual(list(race.columns), [name[len("race__") :] for name in cols])
+        pd.testing.assert_series_equal(t.transform["race__num"], exp)
+
+    def test_load_chunks_record_count(self):
+        template_path = os.path.join(SAMPLES_DIR, "BAC080913.txt")
+        t = BAC(template_path)
+        t.load_chunks(rows=5)
+
+        exp_count = len(t.records)
+        act_count = Race.objects.count()
+
+        self.assertEqual(act_count, exp_count)
+
+    def test_extract_parallel_equals_extract(self):
+        template_path = os.path.join(SAMPLES_DIR, "SED080913.txt")
+        exp = SED(template_path).extract().transform
+        t = SED(template_path).extract_parallel(workers=2)
+        self.assertIsNone(t.df)
+        pd.testing.assert_frame_equal(t.transform, exp)
+
+    def test_extract_parallel_archive_member_equals_extract(self):
+        template_path = os.path.join(SAMPLES_DIR, "SED080913.txt")
+        exp = SED(template_path).extract().transform
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            archive = os.path.join(tmpdir, "archive.zip")
+            with zipfile.ZipFile(archive, "w") as zf:
+                zf.write(template_path, "SED080913.txt")
+            act = SED(f"{archive}::SED080913.txt").extract_parallel(workers=2)
+            pd.testing.assert_frame_equal(act.transform, exp)
+
+    def test_dedupe_transform_equals_transform(self):
+        template_path = os.path.join(SAMPLES_DIR, "KYI150801.txt")
+        t = KYI(template_path).extract()
+        for key, cells in t.cells.items():
+            column = KYI.plan().by_key[key]
+            exp = column.transform(cells)
+            act = column.transform_unique(cells)
+            pd.testing.assert_series_equal(act, exp)
+
+    def test_transform_reads_assigned_df(self):
+        template_path = os.path.join(SAMPLES_DIR, "BAC080913.txt")
+        exp = BAC(template_path).extract().transform.iloc[[3]]
+
+        t = BAC(template_path).extract()
+        t.df = t.df.iloc[[3]]
+        pd.testing.assert_frame_equal(t.transform, exp)
+
+    def test_related_ids_are_refreshed_on_miss(self):
+        symbol = "jrdb.Racetrack.code"
+        ids = get_related_ids(symbol)
+        self.assertEqual(len(ids), Racetrack.objects.count())
+
+        with self.assertNumQueries(0):
+            get_related_ids(symbol, list(ids))
+
+        racetrack = Racetrack.objects.create(code="ZZ", name="", name_en="")
+        self.assertEqual(get_related_ids(symbol, ["ZZ"])["ZZ"], racetrack.id)
+
+    def test_related_id_misses_are_remembered(self):
+        symbol = "jrdb.Racetrack.code"
+        get_related_ids(symbol)
+        self.assertNotIn("  ", get_related_ids(symbol, ["  "]))
+
+        with self.assertNumQueries(0):
+            self.assertNotIn("  ", get_related_ids(symbol, ["  "]))
+
+        racetrack = Racetrack.objects.create(code="  ", name="", name_en="")
+        clear_related_ids(symbol)
+        self.assertEqual(get_related_ids(symbol, ["  "])["  "], racetrack.id)
+
+    def test_threaded_transform_equals_transform(self):
+        template_path = os.path.join(SAMPLES_DIR, "SED080913.txt")
+        exp = SED(template_path).extract().transform
+        act = SED(template_path, transform_workers=4).extract().transform
+        pd.testing.assert_frame_equal(act, exp)
+
+    def test_cached_transform_equals_transform(self):
+        template_path = os.path.join(SAMPLES_DIR, "BAC080913.txt")
+        exp = BAC(template_path).extract().transform
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            BAC(template_path, cache_dir=cache_dir).extract()
+            t = BAC(template_path, cache_dir=cache_dir).extract()
+
+            self.assertIsNone(t.df)
+            pd.testing.assert_frame_equal(t.transform, exp)
+
+
+class ToRecordsTestCase(SimpleTestCase):
+    def test_fixed_width_lines_are_viewed_in_place(self):
+        buf = b"abc\r\ndef\r\n"
+        records = to_records(buf)
+        self.assertEqual(records.shape, (2, 3))
+        self.assertEqual(records.tobytes(), b"abcdef")
+        self.assertIsNotNone(records.base)
+
+    def test_irregular_lines_are_padded(self):
+        records = to_records(b"abc\nde\n\nf")
+        self.assertEqual(records.shape, (3, 3))
+        self.assertEqual(records.tobytes(), b"abcde\x00f\x00\x00")
+
+    def test_memory_mapped_records_are_checked_in_blocks(self):
+        with tempfile.TemporaryFile() as f:
+            for _ in range(8 * 2 ** 10):
+                f.write(b"0123456789" * 99 + b"\r\n")
+            f.flush()
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            tracemalloc.start()
+            records = to_records(buf)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            self.assertEqual(records.shape, (8 * 2 ** 10, 990))
+            self.assertLess(peak, len(buf) / 2)
+            del records
+            buf.close()
+
+
+class TemplateExtractTestCase(SimpleTestCase):
+    def test_memory_mapped_extract_equals_read_extract(self):
+        template_path = os.path.join(SAMPLES_DIR, "OZ020908.txt")
+        exp = OZ(template_path).extract().df
+        act = OZ(template_path, memory_map=True).extract().df
+        self.assertEqual(act.applymap(list).to_dict(), exp.applymap(list).to_dict())
+
+    def test_column_is_view_of_records(self):
+        template_path = os.path.join(SAMPLES_DIR, "OZ020908.txt")
+        t = OZ(template_path, memory_map=True)
+        odds_win = t.column("race__odds_win")
+        self.assertEqual(odds_win.shape, (len(t.records), 18, 5))
+        self.assertTrue(np.shares_memory(odds_win, t.records))
+
+    def test_map_records_equals_records_slice(self):
+        template_path = os.path.join(SAMPLES_DIR, "SED080913.txt")
+        t = SED(template_path)
+        width, stride = t.layout
+        self.assertEqual(width, t.records.shape[1])
+
+        act = map_records(template_path, 10, 20, width, stride)
+        self.assertEqual(act.tobytes(), t.records[10:20].tobytes())
+
+    def test_irregular_records_have_no_layout(self):
+        with tempfile.NamedTemporaryFile(suffix=".txt") as f:
+            f.write(b"abc\nde\n")
+            f.flush()
+            self.assertIsNone(SED(f.name).layout)
+
+    def test_iter_chunks_does_not_split_chunk_by_rows(self):
+        template_path = os.path.join(SAMPLES_DIR, "SED080913.txt")
+        t = SED(template_path)
+        chunks = list(t.iter_chunks(rows=5))
+
+        self.assertEqual(sum(len(chunk.df) for chunk in chunks), len(t.records))
+        keys = [set(map(tuple, chunk.df[SED.chunk_by].values)) for chunk in chunks]
+        for a, b in zip(keys, keys[1:]):
+            self.assertFalse(a & b)
+
+    def test_extract_columns_includes_key_items(self):
+        template_path = os.path.join(SAMPLES_DIR, "KYI150801.txt")
+        t = KYI(template_path).extract(columns=["contender__prel_idm"])
+        exp = [
+            "program__racetrack_code",
+            "program__yr",
+            "program__round",
+            "program__day",
+            "race__num",
+            "contender__num",
+            "contender__prel_idm",
+        ]
+        self.assertEqual(list(t.df.columns), exp)
+
+    def test_extract_columns_includes_transform_requires(self):
+        template_path = os.path.join(SAMPLES_DIR, "KSA020907.txt")
+        t = KZA(template_path).extract(columns=["jockey__birthday"])
+        exp = ["jockey__code", "jockey__name", "jockey__birthday"]
+        self.assertEqual(list(t.df.columns), exp)
+        self.assertEqual(list(t.transform.columns), exp)
+
+    def test_numeric_items_are_extracted_as_bytes(self):
+        template_path = os.path.join(SAMPLES_DIR, "KYI150801.txt")
+        t = KYI(template_path).extract(columns=["horse__name", "contender__prel_idm"])
+        self.assertEqual(t.cells["contender__prel_idm"].dtype.kind, "S")
+        self.assertIsInstance(t.cells["horse__name"], pd.Series)
+        self.assertIsInstance(t.df["contender__prel_idm"][0], bytes)
+        self.assertIsInstance(t.df["horse__name"][0], str)
+
+    def test_templates_pass_checks(self):
+        self.assertEqual(check_templates(None), [])
+
+    def test_plan_validates_items(self):
+        item = IntegerItem("レース名", 50, 0, "jrdb.Race.name")
+        with self.assertRaises(AssertionError):
+            Plan.compile([item])
+
+    def test_checks_report_unknown_fields(self):
+        class UnknownField(Template):
+            items = [IntegerItem("x", 2, 0, "jrdb.Race.no_such_field")]
+
+        with mock.patch("jrdb.templates.UnknownField", UnknownField, create=True):
+            errors = check_templates(None)
+
+        self.assertEqual(
+            [(e.id, e.obj) for e in errors], [("jrdb.E001", "UnknownField")]
+        )
+
+    def test_duplicate_item_keys_are_rejected(self):
+        with self.assertRaises(AssertionError):
+
+            class Duplicate(Template):
+                items = [
+                    IntegerItem("頭数", 2, 0, "jrdb.Race.contender_count"),
+                    IntegerItem("登録頭数", 2, 2, "jrdb.Race.contender_count"),
+                ]
+
+    def test_plan_version_includes_callable_code(self):
+        def item(mapper):
+            return ArrayItem("x", 6, 0, "jrdb.Race.odds_win", 2, mapper=mapper)
+
+        self.assertNotEqual(
+            describe_item(item(lambda a: np.round(a * 0.1, 1))),
+            describe_item(item(lambda a: np.round(a * 0.01, 2))),
+        )
+
+    def test_transform_version_includes_class_settings(self):
+        class RaceBy(SED):
+            race_by = ["race__num"]
+
+        class Override(SED):
+            @cached_property
+            def transform(self):
+                return super().transform.iloc[1:]
+
+        versions = {SED.transform_version(), RaceBy.transform_version()}
+        versions.add(Override.transform_version())
+        self.assertEqual(len(versions), 3)
+
+    def test_plan_is_cached_per_class(self):
+        self.assertIs(SED.plan(), SED.plan())
+        self.assertIsNot(KSA.plan(), KZA.plan())
+        self.assertEqual(KSA.plan().keys, KZA.plan().keys)
+
+
+class NumericItemTestCase(SimpleTestCase):
+    def test_integer_item_substitutes_default(self):
+        item = IntegerItem("頭数", 2, 0, "jrdb.Race.contender_count", default=0)
+        cells = np.array([b"12", b" 3", b"  ", b"1x"])
+        act = item.transform(cells)
+        self.assertEqual(str(act.dtype), "Int64")
+        self.assertEqual(act.tolist(), [12, 3, 0, 0])
+
+    def test_float_item_scales_values(self):
+        item = FloatItem("斤量", 3, 0, "jrdb.Contender.mounted_weight", scale=0.1)
+        cells = np.array([b"575", b"   ", b"-10"])
+        act = item.transform(cells)
+        np.testing.assert_array_equal(act.to_numpy(), [575 * 0.1, np.nan, -10 * 0.1])
+
+
+class GroupModeTestCase(SimpleTestCase):
+    def test_group_mode_breaks_ties_by_smallest_value(self):
+        df = pd.DataFrame(
+            {
+                "race": [1, 1, 1, 1, 2, 2, 3],
+                "value": [3.0, 1.0, 3.0, 1.0, 2.0, np.nan, np.nan],
+            }
+        )
+        act = group_mode(df, ["race"], "value")
+        np.testing.assert_array_equal(act, [1.0, 1.0, 1.0, 1.0, 2.0, 2.0, np.nan])
+
+    def test_aggregate_races_without_aggregates_returns_df(self):
+        df = pd.DataFrame({"race__num": [1, 2]})
+        self.assertIs(BAC("").aggregate_races(df), df)
+
+
+class ArchiveTestCase(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.archive = os.path.join(self.tmpdir.name, "archive.zip")
+        with zipfile.ZipFile(self.archive, "w", zipfile.ZIP_DEFLATED) as zf:
+            for name in ["OZ020908.txt", "SRB080913.txt"]:
+                zf.write(os.path.join(SAMPLES_DIR, name), f"2008/{name}")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_glob_paths_expands_archive_members(self):
+        act = sorted(glob_paths(os.path.join(self.tmpdir.name, "*.zip")))
+        exp = [
+            f"{self.archive}::2008/OZ020908.txt",
+            f"{self.archive}::2008/SRB080913.txt",
+        ]
+        self.assertEqual(act, exp)
+
+    def test_glob_paths_filters_archive_members(self):
+        act = glob_paths(f"{self.archive}::OZ*")
+        self.assertEqual(act, [f"{self.archive}::2008/OZ020908.txt"])
+
+    def test_extract_archive_member(self):
+        t = template_factory(f"{self.archive}::2008/OZ020908.txt")
+        self.assertIsInstance(t, OZ)
+
+        exp = OZ(os.path.join(SAMPLES_DIR, "OZ020908.txt")).records
+        self.assertEqual(t.records.tobytes(), exp.tobytes())
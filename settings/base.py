@@ -21,6 +21,19 @@ DATABASES = {
     },
 }
 
+# jrdb.loaders.DjangoPostgresCopyLoader stages rows with COPY before upserting
+JRDB_LOADER = os.getenv('JRDB_LOADER', 'jrdb.loaders.DjangoPostgresUpsertLoader')
+# Upper bounds of the rows and (estimated) bytes written by one upsert statement,
+# and the latency batch sizes are tuned towards (0 to disable)
+JRDB_LOADER_BATCH_ROWS = int(os.getenv('JRDB_LOADER_BATCH_ROWS', 10000))
+JRDB_LOADER_BATCH_BYTES = int(os.getenv('JRDB_LOADER_BATCH_BYTES', 16 * 2 ** 20))
+JRDB_LOADER_TARGET_SECONDS = float(os.getenv('JRDB_LOADER_TARGET_SECONDS', 0))
+
+# SQLAlchemy connection pool of every process that loads files
+JRDB_DB_POOL_SIZE = int(os.getenv('JRDB_DB_POOL_SIZE', 5))
+JRDB_DB_MAX_OVERFLOW = int(os.getenv('JRDB_DB_MAX_OVERFLOW', 10))
+JRDB_DB_POOL_PRE_PING = os.getenv('JRDB_DB_POOL_PRE_PING', '1') == '1'
+
 LANGUAGE_CODE = 'en-us'
 
 TIME_ZONE = 'UTC'